@@ -4,16 +4,24 @@ Funciones de atomización de eventos para mejor alineación en diffs.
 """
 from genshi.core import START, END, TEXT
 import re
-from .config import STRUCTURAL_TAGS
+from sys import intern as _intern
+from .config import STRUCTURAL_TAGS, STRUCTURAL_REPLACE_TAGS
 from .utils import (
     qname_localname, extract_text_from_events, collapse_ws,
     attrs_signature, structure_signature, is_diff_wrapper
 )
+from .text_differ import split_tokens_cached
 
 
 _list_marker_re = re.compile(r'^[\-\*\•\+]+\s+')
 
 
+def _start_localnames(events):
+    """Localnames internados de los START de un bloque, precalculados para
+    que los filtros de tags del differ no repitan qname_localname por evento."""
+    return tuple(_intern(qname_localname(d[0])) for et, d, _p in events if et == START)
+
+
 def _first_n_cell_texts_from_tr_events(tr_events, n=2):
     """
     Extract visible text from the first N direct child <td>/<th> cells of a <tr>.
@@ -108,9 +116,10 @@ def has_structural_children(block_events):
     return False
 
 
-def create_block_atom_key(lname, block_events, attrs, config, visual_tags):
+def create_block_atom_key(lname, block_events, attrs, config, visual_tags, block_text=None):
     """Crea la clave de atomización para un bloque según su tipo."""
-    block_text = collapse_ws(extract_text_from_events(block_events))
+    if block_text is None:
+        block_text = collapse_ws(extract_text_from_events(block_events))
     if lname in ('td', 'th'):
         # Cells: include attrs + formatting structure so visual-only changes
         # (e.g. strong style) are detected, but ignore indentation whitespace.
@@ -166,7 +175,10 @@ def atomize_events(events, config):
             tag, attrs = data
             lname0 = qname_localname(tag)
             if lname0 == 'br' and i + 1 < n and events[i + 1][0] == END and qname_localname(events[i + 1][1]) == 'br':
-                atoms.append({'kind': 'br', 'key': ('br',), 'events': [events[i], events[i + 1]], 'pos': pos})
+                atoms.append({'kind': 'br', 'sig': ('br', None), 'key': ('br',),
+                              'start_localnames': ('br',), '_text': u'',
+                              '_sssl': None,
+                              'events': [events[i], events[i + 1]], 'pos': pos})
                 i += 2
                 continue
 
@@ -189,11 +201,14 @@ def atomize_events(events, config):
                     has_structural_child = has_structural_children(block_events)
                     if not has_structural_child:
                         # Atomize this div as a visual block
-                        key = (lname, extract_text_from_events(block_events), 
+                        block_text = extract_text_from_events(block_events)
+                        key = (lname, block_text,
                                attrs_signature(attrs, config), 
                                structure_signature(block_events, config)) if lname in visual_tags else \
-                              (lname, extract_text_from_events(block_events))
-                        atoms.append({'kind': 'block', 'tag': lname, 'key': key, 
+                              (lname, block_text)
+                        atoms.append({'kind': 'block', 'tag': lname, 'sig': ('block', _intern(lname)),
+                                    'key': key, 'start_localnames': _start_localnames(block_events),
+                                    '_text': block_text, '_sssl': None,
                                     'events': block_events, 'pos': pos})
                         i = j
                         continue
@@ -201,22 +216,40 @@ def atomize_events(events, config):
                 # For visual containers, include attribute signature so style/class/id
                 # changes produce a 'replace' opcode even if text stays the same.
                 if not (lname == 'div' and has_structural_child):
-                    key = create_block_atom_key(lname, block_events, attrs, config, visual_tags)
-                    atoms.append({'kind': 'block', 'tag': lname, 'key': key, 
+                    # extract_text_from_events ya colapsa el whitespace, así que
+                    # sirve directo como texto cacheado del átomo.
+                    block_text = extract_text_from_events(block_events)
+                    key = create_block_atom_key(lname, block_events, attrs, config, visual_tags,
+                                                block_text=block_text)
+                    atoms.append({'kind': 'block', 'tag': lname, 'sig': ('block', _intern(lname)),
+                                'key': key, 'start_localnames': _start_localnames(block_events),
+                                '_text': block_text, '_sssl': None,
                                 'events': block_events, 'pos': pos})
                     i = j
                     continue
 
         # Tokenize text events for better alignment granularity
         if etype == TEXT and getattr(config, 'tokenize_text', True) and data:
-            parts = [p for p in getattr(config, 'tokenize_regex', _token_split_re).split(data) if p != u'']
+            # Misma caché que text_split: el texto del documento viejo y el
+            # nuevo coincide casi siempre, así que la segunda atomización
+            # tokeniza casi todo por hit de caché.
+            parts = split_tokens_cached(getattr(config, 'tokenize_regex', _token_split_re), data)
             for p in parts:
-                atoms.append({'kind': 'text', 'key': ('t', p), 'events': [(TEXT, p, pos)], 'pos': pos})
+                atoms.append({'kind': 'text', 'sig': ('text', None), 'key': ('t', p),
+                              'start_localnames': (), '_text': p, '_sssl': None,
+                              'events': [(TEXT, p, pos)], 'pos': pos})
             i += 1
             continue
 
-        # Default: single-event atom
-        atoms.append({'kind': 'event', 'key': ('e', etype, data), 'events': [events[i]], 'pos': pos})
+        # Default: single-event atom. _sssl precalcula el localname cuando el
+        # átomo es exactamente un START estructural: la rama de replace del
+        # differ lo compara con dos lookups en vez de re-inspeccionar eventos.
+        ev_lname = _intern(qname_localname(data[0])) if etype == START else None
+        atoms.append({'kind': 'event', 'sig': ('event', None), 'key': ('e', etype, data),
+                      'start_localnames': (ev_lname,) if ev_lname is not None else (),
+                      '_text': (data if etype == TEXT and data else u''),
+                      '_sssl': ev_lname if ev_lname in STRUCTURAL_REPLACE_TAGS else None,
+                      'events': [events[i]], 'pos': pos})
         i += 1
 
     return atoms
@@ -9,10 +9,16 @@ from __future__ import with_statement
 
 from genshi.core import QName, Attrs, START, END, TEXT
 
-from .config import BLOCK_WRAPPER_TAGS
+from .config import BLOCK_WRAPPER_TAGS, STRUCTURAL_REPLACE_TAGS
 from .utils import qname_localname
 from .text_differ import mark_text
 
+# QNames por emisión construidos una sola vez (QName() parsea el string).
+_Q_INS = QName('ins')
+_Q_DEL = QName('del')
+_Q_LI = QName('li')
+_Q_CLASS = QName('class')
+
 
 def handle_start_event(differ, tag, attrs, pos):
     """Handle START events within block_process."""
@@ -27,28 +33,26 @@ def handle_start_event(differ, tag, attrs, pos):
         else:
             # <del>¶<br></del> (put <br> inside <del> so it gets deleted properly)
             # Create <del> tag manually so we can put <br> inside before closing
-            change_tag = QName('del')
+            change_tag = _Q_DEL
             change_attrs = differ._change_attrs(diff_id=differ._active_diff_id())
-            differ.append(START, (change_tag, change_attrs), pos)
-            # Put the marker text inside
-            differ.append(TEXT, marker, pos)
-            # Put the <br> INSIDE the <del> tag
-            differ.append(START, (tag, attrs), pos)
-            differ.append(END, tag, pos)
-            # Now close the <del>
-            differ.append(END, change_tag, pos)
+            differ._emitted_change_markers = True
+            # <del> con el marcador y el <br> adentro, en una sola emisión.
+            differ.extend_raw([(START, (change_tag, change_attrs), pos),
+                               (TEXT, marker, pos),
+                               (START, (tag, attrs), pos),
+                               (END, tag, pos),
+                               (END, change_tag, pos)])
             differ._skip_end_for.append(lname)
         return True
 
     # For structural tags that shouldn't be wrapped in <ins>/<del> (to keep HTML valid
     # and avoid "ghost" cells/bullets), we inject a special class into the tag itself.
-    structural_tags = ('table', 'thead', 'tbody', 'tfoot', 'tr', 'td', 'th', 'ul', 'ol', 'li')
-    if lname in structural_tags and differ._context in ('ins', 'del'):
+    if lname in STRUCTURAL_REPLACE_TAGS and differ._context in ('ins', 'del'):
         suffix = 'added' if differ._context == 'ins' else 'deleted'
         attrs = differ.inject_class(attrs, 'tagdiff_' + suffix)
-        if getattr(differ.config, 'add_diff_ids', False):
+        if differ._add_diff_ids:
             diff_id = differ._active_diff_id() or differ._new_diff_id()
-            attrs = differ._set_attr(attrs, getattr(differ.config, 'diff_id_attr', 'data-diff-id'), diff_id)
+            attrs = differ._set_attr(attrs, differ._diff_id_attr, diff_id)
         
         # Use enter() which preserves the tag but with our new class.
         # We don't return True here because we WANT the children to be processed
@@ -59,20 +63,20 @@ def handle_start_event(differ, tag, attrs, pos):
     # Wrap block wrappers (p, h1, etc.) so the whole element is deleted/inserted.
     # This prevents "empty tags" remaining after accept/reject (e.g. <p><del>...</del></p> -> <p></p>).
     if lname in BLOCK_WRAPPER_TAGS and differ._context in ('ins', 'del'):
-        change_tag = QName(differ._context)
+        change_tag = _Q_INS if differ._context == 'ins' else _Q_DEL
         
         # Special Check: Are we inserting/deleting a block element directly inside a List?
         # e.g. <ul><del><p>...</p></del></ul> is invalid. It should be <ul><li><del><p>...</p></del></li></ul>.
         # Convert context-less blocks into proper list items if needed.
         if differ._stack and qname_localname(differ._stack[-1]) in ('ul', 'ol') and lname != 'li':
             # Inject Synthetic LI wrapper
-            li_tag = QName('li')
+            li_tag = _Q_LI
             li_attrs = Attrs([
-                (QName('class'), 'tagdiff_added' if differ._context == 'ins' else 'tagdiff_deleted')
+                (_Q_CLASS, 'tagdiff_added' if differ._context == 'ins' else 'tagdiff_deleted')
             ])
-            if getattr(differ.config, 'add_diff_ids', False):
+            if differ._add_diff_ids:
                  diff_id = differ._active_diff_id() or differ._new_diff_id()
-                 li_attrs = differ._set_attr(li_attrs, getattr(differ.config, 'diff_id_attr', 'data-diff-id'), diff_id)
+                 li_attrs = differ._set_attr(li_attrs, differ._diff_id_attr, diff_id)
 
             differ.append(START, (li_tag, li_attrs), pos)
             # Ensure we close this LI after the block ends
@@ -87,9 +91,8 @@ def handle_start_event(differ, tag, attrs, pos):
 
     # Wrap void/non-textual elements (e.g. <img>) with <ins>/<del> so the
     # change is visible even though there is no TEXT to mark.
-    wrap_void = set(getattr(differ.config, 'wrap_void_tag_changes_with_ins_del', ()))
-    if lname in wrap_void and differ._context in ('ins', 'del'):
-        change_tag = QName(differ._context)
+    if lname in differ._wrap_void and differ._context in ('ins', 'del'):
+        change_tag = _Q_INS if differ._context == 'ins' else _Q_DEL
         differ.append(START, (change_tag, differ._change_attrs(diff_id=differ._active_diff_id())), pos)
         differ.enter(pos, tag, attrs)
         differ._wrap_change_end_for.append((lname, change_tag, None))
@@ -135,7 +138,9 @@ def handle_text_event(differ, data, pos):
         # Wrap visible text AND inline whitespace (e.g. the space between words)
         # so inserts like "en negrita" highlight the whole phrase including space.
         # Avoid wrapping newline indentation, which would create noisy diffs.
-        if data.strip() or ('\n' not in data and '\r' not in data):
+        # not isspace() equivale a strip() truthy (incluido data == '') sin
+        # alocar el string recortado en cada evento TEXT.
+        if not data.isspace() or ('\n' not in data and '\r' not in data):
             mark_text(differ, pos, data, differ._context)
             return
     differ.append(TEXT, data, pos)
@@ -18,6 +18,10 @@ INLINE_FORMATTING_TAGS = frozenset(['span', 'strong', 'b', 'em', 'i', 'u'])
 BLOCK_WRAPPER_TAGS = frozenset(['p', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6'])
 STRUCTURAL_TAGS = frozenset(['p', 'br', 'table', 'ul', 'ol', 'li', 'tr', 'td', 'th',
                               'h1', 'h2', 'h3', 'h4', 'h5', 'h6'])
+# Contenedores estructurales cuyo START admite un reemplazo "in place"
+# (cambio de atributos o swap ul↔ol) sin anidar del/ins inválidos.
+STRUCTURAL_REPLACE_TAGS = frozenset(['table', 'thead', 'tbody', 'tfoot',
+                                     'tr', 'td', 'th', 'ul', 'ol', 'li'])
 
 
 class DiffConfig(object):
@@ -83,6 +87,11 @@ class DiffConfig(object):
     # are ignored, preventing "shredded" diffs on unrelated texts.
     sequence_match_threshold = 2
 
+    # Texts longer than this (in tokens, per side) skip InsensitiveSequenceMatcher
+    # (quadratic worst case on repetitive text) and use compute_opcodes' capped
+    # Myers path instead. Set very high to always use the matcher.
+    long_text_threshold = 2000
+
     # Global similarity threshold: if SequenceMatcher.ratio() of the full texts is
     # below this value, skip structural matching and render as bulk del + ins.
     # Set to 0 to disable this feature.
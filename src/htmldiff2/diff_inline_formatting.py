@@ -79,7 +79,7 @@ def emit_text_with_formatting(differ, text, formatting, pos, change_tag=None):
     
     # Open change marker if needed
     if change_tag:
-        diff_id = differ._new_diff_id() if getattr(differ.config, 'add_diff_ids', False) else None
+        diff_id = differ._new_diff_id() if differ._add_diff_ids else None
         attrs = differ._change_attrs(diff_id=diff_id)
         differ.append(START, (QName(change_tag), attrs), pos)
     
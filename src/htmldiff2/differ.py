@@ -2,8 +2,11 @@
 
 from __future__ import with_statement
 
+from bisect import bisect_right
 from difflib import SequenceMatcher
 from contextlib import contextmanager
+from itertools import zip_longest
+from operator import itemgetter
 from genshi.core import Stream, QName, Attrs, START, END, TEXT
 
 from .config import DiffConfig, text_type, INLINE_FORMATTING_TAGS, BLOCK_WRAPPER_TAGS
@@ -12,7 +15,7 @@ from .utils import (
     extract_text_from_events, raw_text_from_events, concat_events,
     longest_common_prefix_len, longest_common_suffix_len,
     has_visual_attrs, attrs_signature, structure_signature,
-    merge_adjacent_change_tags, events_equal_normalized
+    merge_adjacent_change_tags, events_equal_normalized, compute_opcodes
 )
 from .atomization import atomize_events
 from .normalization import (
@@ -21,7 +24,6 @@ from .normalization import (
     normalize_inline_wrapper_tag_change_opcodes,
     should_force_visual_replace
 )
-from .parser import longzip
 from .table_differ import (
     extract_direct_tr_cells, extract_tr_blocks, row_key, cell_key,
     diff_table_by_rows, diff_tr_by_cells
@@ -32,17 +34,79 @@ from .visual_replace import (
     can_visual_container_replace, wrap_inline_visual_replace,
     wrap_block_visual_replace, render_visual_replace_inline,
     find_inline_wrapper_bounds, validate_prefix_suffix_alignment,
-    try_inline_wrapper_to_plain
+    try_inline_wrapper_to_plain, compute_replace_features
 )
 from .text_differ import mark_text, diff_text
 
 
+# QName construction parses the qualified-name string on every call; intern
+# the constants used on hot emission paths once at import time. Identity-equal
+# keys also hit the `is` fast path in Attrs lookups.
+_Q_INS = QName('ins')
+_Q_DEL = QName('del')
+_Q_CLASS = QName('class')
+_Q_STYLE = QName('style')
+_Q_OLD_TAG = QName('data-old-tag')
+
+# Attrs es inmutable (subclase de tuple): una sola instancia vacía
+# compartida alcanza para todos los wrappers sin atributos.
+_EMPTY_ATTRS = Attrs()
+
+# List/table tags that force structural handling; frozenset for O(1) membership
+# in the per-event classification loops.
+_LIST_TABLE_TAGS = frozenset(('ul', 'ol', 'li', 'table', 'tr', 'td', 'th'))
+_LIST_ONLY_TAGS = frozenset(('ul', 'ol', 'li'))
+# Accesores C-level para los campos de átomo leídos en masa en process().
+_atom_key = itemgetter('key')
+_atom_text = itemgetter('_text')
+
+
+def _has_structural_tags(atoms, lo_idx, hi_idx):
+    """True si algún átomo del rango abre un tag de lista/tabla. Los
+    localnames de los START vienen precalculados por la atomización
+    (atom['start_localnames'])."""
+    for x in range(lo_idx, hi_idx):
+        if not _LIST_TABLE_TAGS.isdisjoint(atoms[x]['start_localnames']):
+            return True
+    return False
+# Tope de entradas para la memoización de diffs internos; al llegar se vacía
+# entera (los pares repetidos se recalculan una vez, sin contabilidad LRU).
+_INNER_DIFF_CACHE_MAX = 128
+_BLOCK_WRAPPER_LNAMES = frozenset(('p', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6'))
+
+
 def diff_genshi_stream(old_stream, new_stream):
     """Renders a creole diff for two texts."""
     differ = StreamDiffer(old_stream, new_stream)
     return differ.get_diff_stream()
 
 
+def _build_list_end_index(atoms):
+    """
+    Map the atom index of each ul/ol START event to the atom index holding its
+    matching END event.
+
+    Built once per process() pass so structural replace opcodes can locate the
+    list end with a dict lookup instead of re-scanning the whole atom list
+    (which is O(atoms) per opcode, quadratic on documents with many edits).
+    """
+    ends = {}
+    open_stacks = {}
+    for idx, atom in enumerate(atoms):
+        for ev in atom.get('events', []):
+            if ev[0] == START:
+                lname = qname_localname(ev[1][0])
+                if lname in ('ul', 'ol'):
+                    open_stacks.setdefault(lname, []).append(idx)
+            elif ev[0] == END:
+                lname = qname_localname(ev[1])
+                if lname in ('ul', 'ol'):
+                    stack = open_stacks.get(lname)
+                    if stack:
+                        ends[stack.pop()] = idx
+    return ends
+
+
 def render_html_diff(old, new, wrapper_element='div', wrapper_class='diff', config=None):
     """Renders the diff between two HTML fragments."""
     from .parser import parse_html
@@ -58,13 +122,44 @@ class StreamDiffer(object):
 ``<ins>`` and ``<del>`` tags into the stream.
 """
 
+    # Sin __dict__ por instancia: menos memoria y acceso a atributos más
+    # rápido en los bucles calientes. Mantener sincronizado con __init__.
+    __slots__ = (
+        'config', '_add_diff_ids', '_diff_id_attr', '_track_attrs',
+        '_preserve_ws', '_q_diff_id', '_force_tags', '_wrap_void',
+        '_old_events',
+        '_new_events', '_identical', '_old_atoms', '_new_atoms', '_result',
+        '_stack', '_context', '_skip_end_for', '_wrap_change_end_for',
+        '_diff_id_state', '_diff_id_stack', '_style_del_buffer',
+        '_sig_cache', '_vis_repl_cache', '_inner', '_inner_diff_cache',
+        '_emitted_change_markers',
+    )
+
     def __init__(self, old_stream, new_stream, config=None, diff_id_state=None):
         self.config = config or DiffConfig()
-        self._old_events = list(old_stream)
-        self._new_events = list(new_stream)
-        # Atomize for better list/table alignment + text granularity.
-        self._old_atoms = atomize_events(self._old_events, self.config)
-        self._new_atoms = atomize_events(self._new_events, self.config)
+        # Hoist hot config lookups: getattr with default is surprisingly costly
+        # inside the per-event/per-atom loops below.
+        self._add_diff_ids = getattr(self.config, 'add_diff_ids', False)
+        self._diff_id_attr = getattr(self.config, 'diff_id_attr', 'data-diff-id')
+        self._track_attrs = tuple(getattr(self.config, 'track_attrs', ('style', 'class', 'src', 'href')))
+        self._preserve_ws = getattr(self.config, 'preserve_whitespace_in_diff', True)
+        self._q_diff_id = QName(self._diff_id_attr)
+        self._force_tags = frozenset(getattr(self.config, 'force_event_diff_on_equal_for_tags', ()))
+        self._wrap_void = frozenset(getattr(self.config, 'wrap_void_tag_changes_with_ins_del', ()) or ())
+        # Los streams ya materializados (listas) se usan por referencia: nunca
+        # se mutan, así que copiar solo duplicaría la memoria pico.
+        self._old_events = old_stream if isinstance(old_stream, list) else list(old_stream)
+        self._new_events = new_stream if isinstance(new_stream, list) else list(new_stream)
+        # Fast path: identical streams need no atomization or matching at all
+        # (common when re-rendering unchanged documents).
+        self._identical = self._old_events == self._new_events
+        if self._identical:
+            self._old_atoms = []
+            self._new_atoms = []
+        else:
+            # Atomize for better list/table alignment + text granularity.
+            self._old_atoms = atomize_events(self._old_events, self.config)
+            self._new_atoms = atomize_events(self._new_events, self.config)
         self._result = None
         self._stack = []
         self._context = None
@@ -75,6 +170,69 @@ class StreamDiffer(object):
         # Stack for buffering content inside style-changed elements.
         # Each entry: {'tag': QName, 'old_style': str, 'events': list, 'diff_id': str|None}
         self._style_del_buffer = []
+        # Memoización por id() de las listas de eventos de los átomos. Solo es
+        # válida porque esas listas viven en _old_atoms/_new_atoms durante todo
+        # el diff; nunca cachear sobre slices temporales.
+        self._sig_cache = {}
+        self._vis_repl_cache = {}
+        # _EventDiffer reutilizable para los diffs internos (ver _get_inner).
+        self._inner = None
+        # Memoización por contenido de diffs internos (ver _inner_diff_events).
+        self._inner_diff_cache = {}
+        # True en cuanto se emite algún START de ins/del: get_diff_stream solo
+        # corre la pasada de merge cuando hay marcadores que fusionar.
+        self._emitted_change_markers = False
+
+    def _get_inner(self, old_events, new_events):
+        """
+        Devuelve un _EventDiffer para un diff interno, reutilizando una única
+        instancia por differ en lugar de construir una nueva por celda/bloque.
+
+        Es seguro porque cada diff interno se consume por completo antes de
+        pedir el siguiente, y reset() crea una lista _result nueva, así que
+        los resultados ya devueltos nunca se pisan. Los diffs anidados usan
+        el pool de su propia instancia, no el de esta.
+        """
+        inner = self._inner
+        if inner is None:
+            inner = self._inner = _EventDiffer(
+                old_events, new_events, self.config,
+                diff_id_state=self._diff_id_state)
+            return inner
+        return inner.reset(old_events, new_events)
+
+    def _inner_diff_events(self, old_events, new_events):
+        """
+        Ejecuta un diff interno y devuelve su lista de eventos, memoizando
+        por contenido: en HTML con subárboles repetidos (tablas, listas,
+        fragmentos de plantilla) los mismos pares (old, new) reaparecen y su
+        diff es idéntico. La caché solo se usa sin add_diff_ids: con ids
+        activos cada cambio debe consumir ids frescos del contador
+        compartido, así que no se puede reproducir un resultado previo.
+        """
+        if self._add_diff_ids:
+            inner = self._get_inner(old_events, new_events)
+            result = inner.get_diff_events()
+            if inner._emitted_change_markers:
+                self._emitted_change_markers = True
+            return result
+        key = (tuple(old_events), tuple(new_events))
+        cache = self._inner_diff_cache
+        cached = cache.get(key)
+        if cached is not None:
+            result, had_markers = cached
+            if had_markers:
+                self._emitted_change_markers = True
+            return result
+        inner = self._get_inner(old_events, new_events)
+        result = inner.get_diff_events()
+        had_markers = inner._emitted_change_markers
+        if had_markers:
+            self._emitted_change_markers = True
+        if len(cache) >= _INNER_DIFF_CACHE_MAX:
+            cache.clear()
+        cache[key] = (result, had_markers)
+        return result
 
     @contextmanager
     def diff_group(self, diff_id=None):
@@ -83,7 +241,7 @@ class StreamDiffer(object):
 
         When config.add_diff_ids is False, this is a no-op.
         """
-        if not getattr(self.config, 'add_diff_ids', False):
+        if not self._add_diff_ids:
             yield None
             return
         if diff_id is None:
@@ -104,12 +262,15 @@ class StreamDiffer(object):
         return None
 
     def _set_attr(self, attrs, name, value):
-        q = QName(name)
-        try:
-            items = list(attrs) if attrs is not None else []
-        except Exception:
-            items = []
-        items = [(k, v) for (k, v) in items if k != q]
+        # Una sola pasada: filtra el atributo existente y agrega el nuevo
+        # al final, sin listas intermedias ni try/except. El caso dominante
+        # es el atributo de diff-id, cuyo QName ya está construido.
+        q = self._q_diff_id if name == self._diff_id_attr else QName(name)
+        items = []
+        if attrs is not None:
+            for k, v in attrs:
+                if k != q:
+                    items.append((k, v))
         items.append((q, text_type(value)))
         return Attrs(items)
 
@@ -117,13 +278,13 @@ class StreamDiffer(object):
         """
         Build Attrs for an <ins>/<del> wrapper, injecting diff id if enabled.
         """
-        attrs = Attrs(list(base_attrs)) if base_attrs is not None else Attrs()
-        if getattr(self.config, 'add_diff_ids', False):
-            if diff_id is None:
-                diff_id = self._active_diff_id() or self._new_diff_id()
-            attr_name = getattr(self.config, 'diff_id_attr', 'data-diff-id')
-            attrs = self._set_attr(attrs, attr_name, diff_id)
-        return attrs
+        if not self._add_diff_ids:
+            # Sin diff-ids la función no modifica nada: se devuelve la misma
+            # instancia (Attrs es inmutable) y se evita una copia por wrapper.
+            return base_attrs if base_attrs is not None else _EMPTY_ATTRS
+        if diff_id is None:
+            diff_id = self._active_diff_id() or self._new_diff_id()
+        return self._set_attr(base_attrs, self._diff_id_attr, diff_id)
 
     @contextmanager
     def context(self, kind):
@@ -135,13 +296,52 @@ class StreamDiffer(object):
             self._context = old_context
 
     def inject_class(self, attrs, classname):
-        cls = attrs.get('class')
-        attrs |= [(QName('class'), cls and cls + ' ' + classname or classname)]
-        return attrs
+        # Equivalente a get('class') + attrs | [...] pero en una sola pasada.
+        cls = None
+        items = []
+        for k, v in attrs:
+            if k == _Q_CLASS:
+                cls = v
+            else:
+                items.append((k, v))
+        items.append((_Q_CLASS, cls + ' ' + classname if cls else classname))
+        return Attrs(items)
+
+    def _build_replaced_attrs(self, attrs, old_attrs, classname, old_tag=None, diff_id=None):
+        """
+        Fusión de inject_class + inject_refattr + _set_attr en una sola
+        pasada sobre attrs. Cada paso de la cadena original copiaba la lista
+        completa de atributos; aquí se construye el resultado final de una
+        vez, preservando el mismo orden de salida (attrs no-class, class,
+        data-old-*, data-old-tag, diff-id).
+        """
+        cls = None
+        items = []
+        for k, v in attrs:
+            if k == _Q_CLASS:
+                cls = v
+            elif diff_id is not None and k == self._q_diff_id:
+                continue
+            else:
+                items.append((k, v))
+        new_cls = cls + ' ' + classname if cls else classname
+        items.append((_Q_CLASS, new_cls))
+        for attr in self._track_attrs:
+            old_v = old_attrs.get(attr)
+            # 'class' se compara contra el valor ya aumentado, igual que la
+            # cadena original (inject_refattr corría después de inject_class).
+            new_v = new_cls if attr == 'class' else attrs.get(attr)
+            if old_v != new_v and old_v is not None:
+                items.append((QName('data-old-%s' % attr), old_v))
+        if old_tag is not None:
+            items.append((_Q_OLD_TAG, old_tag))
+        if diff_id is not None:
+            items.append((self._q_diff_id, text_type(diff_id)))
+        return Attrs(items)
 
     def inject_refattr(self, attrs, old_attrs):
         # Track attribute changes (visual + refs). Only inject data-old-* when changed.
-        for attr in getattr(self.config, 'track_attrs', ('style', 'class', 'src', 'href')):
+        for attr in self._track_attrs:
             old_attr = old_attrs.get(attr)
             new_attr = attrs.get(attr)
             if old_attr != new_attr:
@@ -151,13 +351,40 @@ class StreamDiffer(object):
                     attrs |= [(QName('data-old-%s' % attr), old_attr)]
         return attrs
 
+    def _structure_sig(self, events):
+        """structure_signature memoizada por id() de la lista de eventos."""
+        sig = self._sig_cache.get(id(events))
+        if sig is None:
+            sig = structure_signature(events, self.config)
+            self._sig_cache[id(events)] = sig
+        return sig
+
+    def _can_visual_container_replace(self, old_events, new_events):
+        """can_visual_container_replace memoizada por par de listas de eventos."""
+        key = (id(old_events), id(new_events))
+        rv = self._vis_repl_cache.get(key)
+        if rv is None:
+            rv = can_visual_container_replace(self, old_events, new_events)
+            self._vis_repl_cache[key] = rv
+        return rv
+
     def append(self, type, data, pos):
+        if type == START and (data[0] == 'ins' or data[0] == 'del'):
+            self._emitted_change_markers = True
         if self._style_del_buffer:
             # Buffering content for a style-changed element
             self._style_del_buffer[-1]['events'].append((type, data, pos))
         else:
             self._result.append((type, data, pos))
 
+    def extend_raw(self, events):
+        # Volcado en bloque de eventos ya armados como tuplas (type, data,
+        # pos): list.extend en C en lugar de un append de Python por evento.
+        if self._style_del_buffer:
+            self._style_del_buffer[-1]['events'].extend(events)
+        else:
+            self._result.extend(events)
+
     def _handle_replace_special_cases(self, old, new, old_start, old_end, new_start, new_end):
         """Maneja casos especiales de reemplazo antes del procesamiento general."""
         # Special-case: one inline wrapper removed/changed while keeping a shared
@@ -166,12 +393,16 @@ class StreamDiffer(object):
         if try_inline_wrapper_to_plain(self, old, new):
             return True
 
+        # Los probes siguientes repiten las mismas pasadas O(n) (strip de
+        # espacios en bordes, texto colapsado); calcularlas una sola vez.
+        features = compute_replace_features(old, new)
+
         # Special-case: visual-only wrapper added/removed around identical text,
         # where the wrapper carries visual styling (style/class/id). In tables this
         # happens a lot (<td>10.8</td> -> <td><strong style=...>10.8</strong></td>).
         # Rendering this as del+ins duplicates the same value and looks terrible.
         # Instead, render a single copy and mark the wrapper as "replaced".
-        if try_visual_wrapper_toggle_without_dup(self, old, new):
+        if try_visual_wrapper_toggle_without_dup(self, old, new, features=features):
             return True
 
         # Fallback: If the new side collapses to a single TEXT node but the old side contains
@@ -185,7 +416,7 @@ class StreamDiffer(object):
 
         # Special-case: unwrap/wrap inline wrapper (e.g. <b>/<strong>) with same text.
         # Fixes Bold -> Normal and maintains consistent Delete -> Insert.
-        if can_unwrap_wrapper(self, old, new):
+        if can_unwrap_wrapper(self, old, new, features=features):
             with self.diff_group():
                 self.delete(old_start, old_end)
                 self.insert(new_start, new_end)
@@ -194,7 +425,7 @@ class StreamDiffer(object):
         # Special-case: visual-only changes (same text, different attrs/tag).
         # Required to mark font-size/font-weight/class/style/id changes as diffs even
         # when text is identical.
-        if can_visual_container_replace(self, old, new):
+        if can_visual_container_replace(self, old, new, features=features):
             if getattr(self.config, 'visual_replace_inline', True):
                 # Render inline del->ins while keeping styles, so changes like
                 # font-size/font-weight don't turn into separate block lines.
@@ -210,37 +441,37 @@ class StreamDiffer(object):
 
     def _handle_matching_event_types(self, old_event, new_event):
         """Maneja eventos del mismo tipo."""
-        event_type = old_event[0]
+        # Desempaquetar una sola vez; ambos eventos comparten el tipo.
+        event_type, old_data, _old_pos = old_event
+        _, new_data, new_pos = new_event
         if event_type == START:
-            old_, (old_tag, old_attrs), old_pos = old_event
-            _, (tag, attrs), pos = new_event
-            self.enter_mark_replaced(pos, tag, attrs, old_attrs)
+            tag, attrs = new_data
+            self.enter_mark_replaced(new_pos, tag, attrs, old_data[1])
         elif event_type == END:
-            _, tag, pos = new_event
-            if not self.leave(pos, tag):
-                self.leave(pos, old_event[1])
+            if not self.leave(new_pos, new_data):
+                self.leave(new_pos, old_data)
         elif event_type == TEXT:
-            _, new_text, pos = new_event
-            diff_text(self, pos, old_event[1], new_text)
+            diff_text(self, new_pos, old_data, new_data)
         else:
             self.append(*new_event)
 
     def _handle_mismatched_event_types(self, old_event, new_event, old_start, old_end, 
                                        new_start, new_end, idx):
         """Maneja eventos de tipos diferentes."""
+        old_type, old_data, old_pos = old_event
+        new_type, new_data, new_pos = new_event
+
         # If the old event was text and the new one is the start or end of a tag
-        if old_event[0] == TEXT and new_event[0] in (START, END):
-            _, text, pos = old_event
-            mark_text(self, pos, text, 'del')
-            type, data, pos = new_event
-            if type == START:
-                self.enter(pos, *data)
+        if old_type == TEXT and new_type in (START, END):
+            mark_text(self, old_pos, old_data, 'del')
+            if new_type == START:
+                self.enter(new_pos, *new_data)
             else:
-                self.leave(pos, data)
+                self.leave(new_pos, new_data)
             return False
 
         # Old stream opened or closed a tag that went away in the new one
-        if old_event[0] in (START, END) and new_event[0] == TEXT:
+        if old_type in (START, END) and new_type == TEXT:
             # Prefer a stable delete->insert representation that preserves
             # the old formatting wrappers (e.g. <strong>...) instead of
             # dropping them and emitting only an <ins>.
@@ -263,24 +494,29 @@ class StreamDiffer(object):
         if self._handle_replace_special_cases(old, new, old_start, old_end, new_start, new_end):
             return
 
-        # Process events pairwise
-        for idx, (old_event, new_event) in enumerate(longzip(old, new)):
-            if old_event is None:
-                self.insert(new_start + idx, new_end + idx)
-                break
-            elif new_event is None:
-                self.delete(old_start + idx, old_end + idx)
-                break
- 
+        # Process events pairwise. Indexado explícito en lugar de longzip:
+        # menos overhead por iteración y permite cortar con return directo.
+        lo, ln = len(old), len(new)
+        for idx in range(min(lo, ln)):
+            old_event = old[idx]
+            new_event = new[idx]
+
             # Handle matching event types
             if old_event[0] == new_event[0]:
                 self._handle_matching_event_types(old_event, new_event)
             else:
                 # Handle mismatched event types
-                if self._handle_mismatched_event_types(old_event, new_event, 
-                                                       old_start, old_end, 
+                if self._handle_mismatched_event_types(old_event, new_event,
+                                                       old_start, old_end,
                                                        new_start, new_end, idx):
-                    break
+                    return
+
+        if ln > lo:
+            self.insert(new_start + lo, new_end + lo)
+        elif lo > ln + 1:
+            # longzip consumía el evento del límite sin emitirlo; el primer par
+            # con None aparecía recién en old[ln+1]. Se conserva esa semántica.
+            self.delete(old_start + ln, old_end + ln)
 
 
     def delete(self, start, end):
@@ -327,9 +563,9 @@ class StreamDiffer(object):
             if non_style_match and normalize_style_value(old_style) != normalize_style_value(new_style):
                 # Style-only change on same tag: enter normally, buffer content for del/ins
                 diff_id = None
-                if getattr(self.config, 'add_diff_ids', False):
+                if self._add_diff_ids:
                     diff_id = self._active_diff_id() or self._new_diff_id()
-                    attrs = self._set_attr(attrs, getattr(self.config, 'diff_id_attr', 'data-diff-id'), diff_id)
+                    attrs = self._set_attr(attrs, self._diff_id_attr, diff_id)
                 self._stack.append(tag)
                 self.append(START, (tag, attrs), pos)
                 self._style_del_buffer.append({
@@ -341,13 +577,13 @@ class StreamDiffer(object):
                 return
 
         # Fallback: use tagdiff_replaced for tag changes or complex attr changes
-        attrs = self.inject_class(attrs, 'tagdiff_replaced')
-        attrs = self.inject_refattr(attrs, old_attrs)
-        if old_tag and old_tag != tag:
-             attrs |= [(QName('data-old-tag'), qname_localname(old_tag))]
-        if getattr(self.config, 'add_diff_ids', False):
+        diff_id = None
+        if self._add_diff_ids:
             diff_id = self._active_diff_id() or self._new_diff_id()
-            attrs = self._set_attr(attrs, getattr(self.config, 'diff_id_attr', 'data-diff-id'), diff_id)
+        attrs = self._build_replaced_attrs(
+            attrs, old_attrs, 'tagdiff_replaced',
+            old_tag=(qname_localname(old_tag) if old_tag and old_tag != tag else None),
+            diff_id=diff_id)
         self._stack.append(tag)
         self.append(START, (tag, attrs), pos)
 
@@ -365,24 +601,22 @@ class StreamDiffer(object):
                 # Emit del with old style
                 del_attrs = Attrs()
                 if old_style:
-                    del_attrs = del_attrs | [(QName('style'), old_style)]
+                    del_attrs = del_attrs | [(_Q_STYLE, old_style)]
                 if diff_id:
                     inner_id = self._new_diff_id()
-                    del_attrs = del_attrs | [(QName(getattr(self.config, 'diff_id_attr', 'data-diff-id')), inner_id)]
-                self.append(START, (QName('del'), del_attrs), (None, -1, -1))
-                for ev in buffered:
-                    self.append(*ev)
-                self.append(END, QName('del'), (None, -1, -1))
+                    del_attrs = del_attrs | [(self._q_diff_id, inner_id)]
+                self.append(START, (_Q_DEL, del_attrs), (None, -1, -1))
+                self.extend_raw(buffered)
+                self.append(END, _Q_DEL, (None, -1, -1))
 
                 # Emit ins
                 ins_attrs = Attrs()
                 if diff_id:
                     ins_id = self._new_diff_id()
-                    ins_attrs = ins_attrs | [(QName(getattr(self.config, 'diff_id_attr', 'data-diff-id')), ins_id)]
-                self.append(START, (QName('ins'), ins_attrs), (None, -1, -1))
-                for ev in buffered:
-                    self.append(*ev)
-                self.append(END, QName('ins'), (None, -1, -1))
+                    ins_attrs = ins_attrs | [(self._q_diff_id, ins_id)]
+                self.append(START, (_Q_INS, ins_attrs), (None, -1, -1))
+                self.extend_raw(buffered)
+                self.append(END, _Q_INS, (None, -1, -1))
 
             self.append(END, tag, pos)
             self._stack.pop()
@@ -398,65 +632,80 @@ class StreamDiffer(object):
 
     def block_process(self, events):
         """Process block-level events."""
+        # Camino rápido: sin contexto ins/del ni buffers activos los eventos
+        # pasan tal cual y solo hay que mantener _stack. Evita el despacho
+        # por evento de block_processor en las corridas sin cambios, que
+        # suelen dominar el documento.
+        if (self._context is None and not self._style_del_buffer
+                and not self._skip_end_for and not self._wrap_change_end_for):
+            result_append = self._result.append
+            stack = self._stack
+            for ev in events:
+                et = ev[0]
+                if et == START:
+                    stack.append(ev[1][0])
+                elif et == END:
+                    # leave() descarta END sin START correspondiente.
+                    if not stack or ev[1] != stack[-1]:
+                        continue
+                    stack.pop()
+                result_append(ev)
+            return
         block_process_events(self, events)
 
 
 
 
 
-    def _process_replace_opcode(self, old_atoms_slice, new_atoms_slice):
-        """Procesa un opcode de tipo 'replace'."""
-        old_events = concat_events(old_atoms_slice)
-        new_events = concat_events(new_atoms_slice)
-        
-        # SIEMPRE agrupar si hay un cambio estructural de lista (bullets)
-        # o si hay una mezcla de tags estructurales que el matcher
-        # no pudo alinear perfectamente.
-        def _has_structural_tags(events):
-            for et, d, _p in events:
-                if et == START:
-                    t, _a = d
-                    ln = qname_localname(t)
-                    if ln in ("ul", "ol", "li", "table", "tr", "td", "th"):
-                        return True
-            return False
+    def _process_replace_opcode(self, i1, i2, j1, j2):
+        """Procesa un opcode de tipo 'replace' sobre los rangos [i1:i2) /
+        [j1:j2) de los átomos del differ (índices en lugar de slices, para
+        no copiar listas de punteros por opcode)."""
+        old_atoms = self._old_atoms
+        new_atoms = self._new_atoms
+        lo = i2 - i1
+        ln = j2 - j1
 
         # Si el cambio involucra tags estructurales, forzamos un bloque atómico.
         # EXCEPCIÓN: Si los átomos de ambos lados son exactamente iguales en cantidad
         # y tipo de tag, dejamos que el inner differ lo maneje (para cambios de estilo).
+        # Atom 'sig' tuples are precomputed at atomization time so this pairwise
+        # check is a single tuple compare instead of several dict lookups.
         is_pure_style_structural = (
-            len(old_atoms_slice) == len(new_atoms_slice) and
-            all(a1.get('kind') == 'block' and a2.get('kind') == 'block' and a1.get('tag') == a2.get('tag')
-                for a1, a2 in zip(old_atoms_slice, new_atoms_slice))
+            lo == ln and
+            all(old_atoms[i1 + off]['sig'] == new_atoms[j1 + off]['sig']
+                and old_atoms[i1 + off]['sig'][0] == 'block'
+                for off in range(lo))
         )
 
         # Special-case: <tr> blocks should be diffed by cells, not by raw events.
         if (
             is_pure_style_structural
-            and len(old_atoms_slice) == 1
-            and len(new_atoms_slice) == 1
-            and old_atoms_slice[0].get('kind') == 'block'
-            and new_atoms_slice[0].get('kind') == 'block'
-            and old_atoms_slice[0].get('tag') == 'tr'
-            and new_atoms_slice[0].get('tag') == 'tr'
+            and lo == 1
+            and ln == 1
+            and old_atoms[i1]['sig'] == ('block', 'tr')
+            and new_atoms[j1]['sig'] == ('block', 'tr')
         ):
-            diff_tr_by_cells(self, old_atoms_slice[0]['events'], new_atoms_slice[0]['events'])
+            diff_tr_by_cells(self, old_atoms[i1]['events'], new_atoms[j1]['events'])
             return
 
         # Special-case: whole table blocks should be diffed by rows/cells (keeps HTML valid
         # even if table attributes change and avoids splitting table start/end across opcodes).
         if (
-            len(old_atoms_slice) == 1
-            and len(new_atoms_slice) == 1
-            and old_atoms_slice[0].get("kind") == "block"
-            and new_atoms_slice[0].get("kind") == "block"
-            and old_atoms_slice[0].get("tag") == "table"
-            and new_atoms_slice[0].get("tag") == "table"
+            lo == 1
+            and ln == 1
+            and old_atoms[i1]['sig'] == ('block', 'table')
+            and new_atoms[j1]['sig'] == ('block', 'table')
         ):
-            diff_table_by_rows(self, old_atoms_slice[0]["events"], new_atoms_slice[0]["events"])
+            diff_table_by_rows(self, old_atoms[i1]["events"], new_atoms[j1]["events"])
             return
 
-        if (_has_structural_tags(old_events) or _has_structural_tags(new_events)) and not is_pure_style_structural:
+        # Los eventos concatenados recién hacen falta a partir de acá; los
+        # casos especiales de arriba trabajan sobre los átomos directamente.
+        old_events = concat_events(old_atoms, i1, i2)
+        new_events = concat_events(new_atoms, j1, j2)
+
+        if (_has_structural_tags(old_atoms, i1, i2) or _has_structural_tags(new_atoms, j1, j2)) and not is_pure_style_structural:
             with self.diff_group():
                 with self.context("del"):
                     self.block_process(old_events)
@@ -466,40 +715,45 @@ class StreamDiffer(object):
 
         # Default: Diff the expanded events with an inner EventDiffer (no atomization)
         # Pass current diff_id_state to maintain consistent IDs
-        inner = _EventDiffer(old_events, new_events, self.config, diff_id_state=self._diff_id_state)
-        for ev in inner.get_diff_events():
-            self.append(*ev)
+        self.extend_raw(self._inner_diff_events(old_events, new_events))
 
-    def _process_equal_opcode(self, old_atoms_slice, new_atoms_slice):
-        """Procesa un opcode de tipo 'equal' con manejo especial para tablas."""
+    def _process_equal_opcode(self, i1, i2, j1, j2):
+        """Procesa un opcode de tipo 'equal' con manejo especial para tablas,
+        sobre los rangos [i1:i2) / [j1:j2) de los átomos del differ."""
         # For table/list-related blocks, run an inner event diff even when the
         # outer atom keys are equal. This catches visual-only formatting
         # changes (e.g. <th> style, wrapping <strong style=...>) without
         # breaking structure.
-        for a_old, a_new in longzip(old_atoms_slice, new_atoms_slice):
-            if a_old is None:
-                with self.context(None):
-                    self.block_process(concat_events([a_new]))
-                continue
-            if a_new is None:
+        old_atoms = self._old_atoms
+        new_atoms = self._new_atoms
+        lo = i2 - i1
+        ln = j2 - j1
+        # Indexado explícito en lugar de longzip sobre slices: mismos pares,
+        # sin copiar las listas de átomos (las colas se emiten más abajo).
+        for off in range(lo if lo < ln else ln):
+            a_old = old_atoms[i1 + off]
+            a_new = new_atoms[j1 + off]
+
+            # Átomos idénticos evento a evento: pasar directo, sin probes
+            # visuales ni de whitespace. Es el caso más común en documentos
+            # mayormente sin cambios.
+            if a_old['events'] is a_new['events'] or a_old['events'] == a_new['events']:
                 with self.context(None):
-                    self.block_process(concat_events([a_old]))
+                    self.block_process(a_new['events'])
                 continue
-            
+
             # Special case: Paragraph <-> List Item transition with matching text
             # (bullet stripping in atomization makes keys equal).
             # Force inner diff to show granular "-" deletion / bullet insertion.
-            old_t = a_old.get('tag')
-            new_t = a_new.get('tag')
+            old_kind, old_t = a_old['sig']
+            new_kind, new_t = a_new['sig']
             if (old_t == 'p' and new_t == 'li') or (old_t == 'li' and new_t == 'p'):
-                 inner = _EventDiffer(a_old['events'], a_new['events'], self.config, diff_id_state=self._diff_id_state)
-                 for ev in inner.get_diff_events():
-                     self.append(*ev)
+                 self.extend_raw(self._inner_diff_events(a_old['events'], a_new['events']))
                  continue
 
             # Si el texto es igual pero los tags son distintos (ej: <p> -> <li>), 
             # forzamos un bloque diff atómico con un solo ID.
-            if a_new.get('kind') == 'block' and a_old.get('kind') == 'block' and a_old['events'][0][1][0] != a_new['events'][0][1][0]:
+            if new_kind == 'block' and old_kind == 'block' and a_old['events'][0][1][0] != a_new['events'][0][1][0]:
                 with self.diff_group():
                     with self.context('del'):
                         self.block_process(a_old['events'])
@@ -507,28 +761,26 @@ class StreamDiffer(object):
                         self.block_process(a_new['events'])
                 continue
 
-            is_structural = a_new.get('kind') == 'block' and a_new.get('tag') in ('table', 'tr', 'td', 'th', 'ul', 'ol', 'li')
-            
+            is_structural = new_kind == 'block' and new_t in _LIST_TABLE_TAGS
+
             if is_structural:
-                if a_new.get('tag') == 'tr':
+                if new_t == 'tr':
                     diff_tr_by_cells(self, a_old['events'], a_new['events'])
-                elif a_new.get('tag') == 'table':
+                elif new_t == 'table':
                     diff_table_by_rows(self, a_old['events'], a_new['events'])
                 else:
-                    inner = _EventDiffer(a_old['events'], a_new['events'], self.config, diff_id_state=self._diff_id_state)
-                    for ev in inner.get_diff_events():
-                        self.append(*ev)
+                    self.extend_raw(self._inner_diff_events(a_old['events'], a_new['events']))
             else:
                 old_events = a_old.get('events') or []
                 new_events = a_new.get('events') or []
 
                 # Visual-only attribute changes (same text, different style/class/attrs)
                 # should still produce a visible diff even when atom keys match.
-                if not events_equal_normalized(old_events, new_events) and can_visual_container_replace(self, old_events, new_events):
+                if not events_equal_normalized(old_events, new_events) and self._can_visual_container_replace(old_events, new_events):
                     # Check if the structure differs (e.g. <strong> tags added/removed).
                     # If so, run a granular inner diff on children instead of full block replace.
-                    old_sig = structure_signature(old_events, self.config)
-                    new_sig = structure_signature(new_events, self.config)
+                    old_sig = self._structure_sig(old_events)
+                    new_sig = self._structure_sig(new_events)
                     
                     if old_sig != new_sig:
                         # Structure differs - use specialized inline formatting diff
@@ -549,9 +801,7 @@ class StreamDiffer(object):
                             old_children = old_events[1:-1]
                             new_children = new_events[1:-1]
                             
-                            inner = _EventDiffer(old_children, new_children, self.config, diff_id_state=self._diff_id_state)
-                            for ev in inner.get_diff_events():
-                                self.append(*ev)
+                            self.extend_raw(self._inner_diff_events(old_children, new_children))
                             
                             self.leave(new_events[-1][2], new_events[-1][1])
                             continue
@@ -574,9 +824,7 @@ class StreamDiffer(object):
                             old_children = old_events[1:-1]
                             new_children = new_events[1:-1]
                             
-                            inner = _EventDiffer(old_children, new_children, self.config, diff_id_state=self._diff_id_state)
-                            for ev in inner.get_diff_events():
-                                self.append(*ev)
+                            self.extend_raw(self._inner_diff_events(old_children, new_children))
                             
                             self.leave(new_events[-1][2], new_events[-1][1])
                             continue
@@ -605,9 +853,7 @@ class StreamDiffer(object):
                             old_txt = old_events[1][1] or u''
                             new_txt = new_events[1][1] or u''
                             if old_txt != new_txt and collapse_ws(old_txt) == collapse_ws(new_txt):
-                                inner = _EventDiffer(old_events, new_events, self.config, diff_id_state=self._diff_id_state)
-                                for ev in inner.get_diff_events():
-                                    self.append(*ev)
+                                self.extend_raw(self._inner_diff_events(old_events, new_events))
                                 continue
                     except Exception:
                         # If anything goes wrong, fall back to unchanged rendering.
@@ -631,9 +877,7 @@ class StreamDiffer(object):
                             old_children = old_events[1:-1]
                             new_children = new_events[1:-1]
                             
-                            inner = _EventDiffer(old_children, new_children, self.config, diff_id_state=self._diff_id_state)
-                            for ev in inner.get_diff_events():
-                                self.append(*ev)
+                            self.extend_raw(self._inner_diff_events(old_children, new_children))
                             
                             self.leave(new_events[-1][2], new_events[-1][1])
                             continue
@@ -641,17 +885,10 @@ class StreamDiffer(object):
                 # If atoms compare equal by key but differ in event streams due to
                 # non-textual "void" elements (e.g. <img>), run an inner event diff
                 # so additions/removals become visible as <ins>/<del>.
-                force_tags = set(getattr(self.config, 'force_event_diff_on_equal_for_tags', ()))
+                force_tags = self._force_tags
                 if force_tags and not events_equal_normalized(old_events, new_events):
-                    def _has_force_tag(events):
-                        for et, d, _p in events:
-                            if et == START:
-                                t, _a = d
-                                if qname_localname(t) in force_tags:
-                                    return True
-                        return False
-
-                    if _has_force_tag(old_events) or _has_force_tag(new_events):
+                    if (not force_tags.isdisjoint(a_old['start_localnames'])
+                            or not force_tags.isdisjoint(a_new['start_localnames'])):
                         # Prefer diffing only the *children* when both sides are a
                         # simple container (START...END). This keeps unchanged prefix
                         # text outside of <del>/<ins> when the only real change is a
@@ -675,7 +912,7 @@ class StreamDiffer(object):
                             def _visible_ws(s):
                                 if not s:
                                     return s
-                                if not getattr(self.config, 'preserve_whitespace_in_diff', True):
+                                if not self._preserve_ws:
                                     return s
                                 # Keep newlines (indentation) as-is, but make inline
                                 # whitespace visible inside <ins>/<del>.
@@ -683,15 +920,19 @@ class StreamDiffer(object):
 
                             def _split_text_then_force_tail(children):
                                 # Keep leading/trailing whitespace-only TEXT as-is, but require
-                                # at most one TEXT with non-whitespace content.
+                                # at most one TEXT with non-whitespace content. Una sola pasada;
+                                # str.isspace() evita los temporales de .strip().
                                 if children is None:
                                     return None
-                                leading_ws = []
+                                n_children = len(children)
                                 i = 0
-                                while i < len(children) and children[i][0] == TEXT and (children[i][1] or u'').strip() == u'':
-                                    leading_ws.append(children[i])
+                                while i < n_children:
+                                    et, d, _p = children[i]
+                                    if et != TEXT or (d and not d.isspace()):
+                                        break
                                     i += 1
-                                if i >= len(children):
+                                leading_ws = children[:i]
+                                if i >= n_children:
                                     return leading_ws, None, []
                                 if children[i][0] != TEXT:
                                     return None
@@ -700,7 +941,7 @@ class StreamDiffer(object):
                                 # Tail must be whitespace-only TEXT or START/END of force tags.
                                 for et, d, _p in tail:
                                     if et == TEXT:
-                                        if (d or u'').strip() != u'':
+                                        if d and not d.isspace():
                                             return None
                                     elif et in (START, END):
                                         t = d[0] if et == START else d
@@ -728,62 +969,102 @@ class StreamDiffer(object):
                                     common_suffix = old_text[len(old_text) - suf_len:] if suf_len else u''
 
                                     # Emit leading whitespace from "new"
-                                    for ev in new_lead:
-                                        self.append(*ev)
+                                    self.extend_raw(new_lead)
                                     # Emit common text unchanged (prefix + suffix)
                                     self.append(TEXT, common_prefix + common_suffix, new_text_ev[2])
 
+                                    # Un solo lookup del diff id activo para
+                                    # la rama que se tome.
+                                    _did = self._active_diff_id()
+
                                     # Delete tail (mid + old_tail)
                                     if (old_mid or old_tail) and not (new_mid or new_tail):
-                                        self.append(START, (QName('del'), self._change_attrs(diff_id=self._active_diff_id())), old_text_ev[2])
+                                        self.append(START, (_Q_DEL, self._change_attrs(diff_id=_did)), old_text_ev[2])
                                         if old_mid:
                                             self.append(TEXT, _visible_ws(old_mid), old_text_ev[2])
-                                        for ev in old_tail:
-                                            self.append(*ev)
-                                        self.append(END, QName('del'), old_text_ev[2])
+                                        self.extend_raw(old_tail)
+                                        self.append(END, _Q_DEL, old_text_ev[2])
                                     # Insert tail (mid + new_tail)
                                     elif (new_mid or new_tail) and not (old_mid or old_tail):
-                                        self.append(START, (QName('ins'), self._change_attrs(diff_id=self._active_diff_id())), new_text_ev[2])
+                                        self.append(START, (_Q_INS, self._change_attrs(diff_id=_did)), new_text_ev[2])
                                         if new_mid:
                                             self.append(TEXT, _visible_ws(new_mid), new_text_ev[2])
-                                        for ev in new_tail:
-                                            self.append(*ev)
-                                        self.append(END, QName('ins'), new_text_ev[2])
+                                        self.extend_raw(new_tail)
+                                        self.append(END, _Q_INS, new_text_ev[2])
                                     else:
                                         # Fallback to inner differ for anything more complex
-                                        inner = _EventDiffer(old_children, new_children, self.config, diff_id_state=self._diff_id_state)
-                                        for ev in inner.get_diff_events():
-                                            self.append(*ev)
+                                        self.extend_raw(self._inner_diff_events(old_children, new_children))
 
                                     # Emit trailing whitespace from "new" (events after tail are none by design)
                                     self.leave(new_events[-1][2], new_events[-1][1])
                                     continue
 
-                            inner = _EventDiffer(old_children, new_children, self.config, diff_id_state=self._diff_id_state)
-                            for ev in inner.get_diff_events():
-                                self.append(*ev)
+                            self.extend_raw(self._inner_diff_events(old_children, new_children))
                             self.leave(new_events[-1][2], new_events[-1][1])
                             continue
 
-                        inner = _EventDiffer(old_events, new_events, self.config, diff_id_state=self._diff_id_state)
-                        for ev in inner.get_diff_events():
-                            self.append(*ev)
+                        self.extend_raw(self._inner_diff_events(old_events, new_events))
                         continue
 
                 with self.context(None):
                     self.block_process(new_events)
 
+        # Colas sin par: replican la semántica de longzip, incluido el
+        # descarte silencioso del átomo del límite cuando el lado viejo es
+        # más largo (longzip lo consumía sin emitirlo).
+        if ln > lo:
+            for x in range(j1 + lo, j2):
+                with self.context(None):
+                    self.block_process(new_atoms[x]['events'])
+        elif lo > ln + 1:
+            for x in range(i1 + ln + 1, i2):
+                with self.context(None):
+                    self.block_process(old_atoms[x]['events'])
+
     def process(self):
         self._result = []
-        
+
+        # Identical documents: stream the events through unchanged, skipping
+        # the SequenceMatcher pass entirely.
+        if self._identical:
+            with self.context(None):
+                self.block_process(self._old_events)
+            self.leave_all()
+            return
+
+        # Identical atom key sequences: a full matcher pass would only emit one
+        # big 'equal' opcode, so dispatch it directly and skip both the bulk
+        # similarity ratio and the (worst-case quadratic) SequenceMatcher.
+        # map + itemgetter iteran y acceden al dict a nivel C, sin el
+        # despacho del intérprete por átomo del listcomp equivalente.
+        old_keys = list(map(_atom_key, self._old_atoms))
+        new_keys = list(map(_atom_key, self._new_atoms))
+        if old_keys == new_keys:
+            self._process_equal_opcode(0, len(self._old_atoms), 0, len(self._new_atoms))
+            self.leave_all()
+            return
+
         # Global similarity check: if texts are too different, do bulk del + ins
         # instead of granular structural matching (avoids interleaved shredding).
         bulk_threshold = getattr(self.config, 'bulk_replace_similarity_threshold', 0.3)
         if bulk_threshold > 0:
-            old_text = extract_text_from_events(self._old_events)
-            new_text = extract_text_from_events(self._new_events)
+            # Texto por átomo cacheado en la atomización: evita volver a
+            # caminar todos los eventos TEXT del documento solo para el ratio.
+            old_text = u' '.join(filter(None, map(_atom_text, self._old_atoms)))
+            new_text = u' '.join(filter(None, map(_atom_text, self._new_atoms)))
             if old_text.strip() and new_text.strip():
-                ratio = SequenceMatcher(None, old_text, new_text).ratio()
+                la, lb = len(old_text), len(new_text)
+                # Escalera de cotas superiores de ratio(): el largo
+                # (real_quick_ratio, O(1), calculado a mano para no construir
+                # el matcher), luego quick_ratio (O(n)) y recién ratio (O(n·m)).
+                if 2.0 * min(la, lb) / (la + lb) < bulk_threshold:
+                    ratio = 0.0
+                else:
+                    sm = SequenceMatcher(None, old_text, new_text)
+                    if sm.quick_ratio() < bulk_threshold:
+                        ratio = 0.0
+                    else:
+                        ratio = sm.ratio()
                 if ratio < bulk_threshold:
                     # Texts are too different - render as bulk delete then bulk insert
                     with self.diff_group():
@@ -793,30 +1074,82 @@ class StreamDiffer(object):
                             self.block_process(self._new_events)
                     return
         
-        # Run SequenceMatcher on atom keys (better alignment for lists/tables/text).
-        old_keys = [a['key'] for a in self._old_atoms]
-        new_keys = [a['key'] for a in self._new_atoms]
-        matcher = SequenceMatcher(None, old_keys, new_keys)
-        opcodes = matcher.get_opcodes()
+        # Match atom keys (better alignment for lists/tables/text).
+        # compute_opcodes usa SequenceMatcher con autojunk=False en secuencias
+        # cortas (autojunk descartaría átomos "populares" como los de
+        # whitespace) y Myers casi lineal en documentos grandes.
+        # Las claves (tuplas anidadas) se internan a enteros: el matcher las
+        # hashea y compara muchas veces y un int lo resuelve en una operación.
+        key_to_id = {}
+        enc = key_to_id.setdefault
+        old_ids = [enc(key, len(key_to_id)) for key in old_keys]
+        new_ids = [enc(key, len(key_to_id)) for key in new_keys]
+        opcodes = compute_opcodes(old_ids, new_ids)
         if getattr(self.config, 'delete_first', True):
             opcodes = normalize_opcodes_for_delete_first(opcodes)
 
-        def _has_list_tags(events):
-            for et, d, _p in events:
-                if et == START:
-                    t, _a = d
-                    if qname_localname(t) in ("ul", "ol", "li"):
-                        return True
+        # Inverse maps for the structural list search below: list START atom
+        # index -> matching END atom index, computed in one linear pass.
+        old_list_ends = _build_list_end_index(self._old_atoms)
+        new_list_ends = _build_list_end_index(self._new_atoms)
+
+        # Ambos discriminadores operan sobre los localnames precalculados de
+        # los átomos (O(átomos)) en vez de recorrer cada evento del slice.
+        def _has_list_tags(atoms, lo_idx, hi_idx):
+            for x in range(lo_idx, hi_idx):
+                if not _LIST_ONLY_TAGS.isdisjoint(atoms[x]['start_localnames']):
+                    return True
             return False
 
-        def _count_block_wrappers(events):
+        def _block_wrappers_exceeds(atoms, lo_idx, hi_idx, cap):
+            # Los llamadores solo comparan contra un tope chico: cortar en
+            # cuanto se supera en vez de contar todos los wrappers del rango.
             count = 0
-            for et, d, _p in events:
-                if et == START:
-                    t, _a = d
-                    if qname_localname(t) in ("p", "h1", "h2", "h3", "h4", "h5", "h6"):
+            for x in range(lo_idx, hi_idx):
+                for t in atoms[x]['start_localnames']:
+                    if t in _BLOCK_WRAPPER_LNAMES:
                         count += 1
-            return count
+                        if count > cap:
+                            return True
+            return False
+
+        # Pre-pasada: los pares delete+insert (o insert+delete) adyacentes que
+        # el discriminador de listas identifica como conversión texto↔lista se
+        # fusionan en un opcode sintético 'list_conv'. El bucle principal queda
+        # así sin la mirada a opcodes[k + 1] en cada iteración.
+        fused = []
+        n_ops = len(opcodes)
+        k = 0
+        while k < n_ops:
+            op = opcodes[k]
+            tag = op[0]
+            if tag in ('delete', 'insert') and k + 1 < n_ops:
+                _tag, i1, i2, j1, j2 = op
+                tag2, i1b, i2b, j1b, j2b = opcodes[k + 1]
+                if tag == 'delete' and tag2 == 'insert':
+                    if (_has_list_tags(self._old_atoms, i1, i2)
+                            != _has_list_tags(self._new_atoms, j1b, j2b)
+                            and not _block_wrappers_exceeds(self._old_atoms, i1, i2, 1)
+                            and not _block_wrappers_exceeds(self._new_atoms, j1b, j2b, 2)):
+                        fused.append(('list_conv', i1, i2, j1b, j2b))
+                        k += 2
+                        continue
+                elif tag == 'insert' and tag2 == 'delete':
+                    if (_has_list_tags(self._old_atoms, i1b, i2b)
+                            != _has_list_tags(self._new_atoms, j1, j2)
+                            and not _block_wrappers_exceeds(self._old_atoms, i1b, i2b, 1)
+                            and not _block_wrappers_exceeds(self._new_atoms, j1, j2, 2)):
+                        fused.append(('list_conv', i1b, i2b, j1, j2))
+                        k += 2
+                        continue
+            fused.append(op)
+            k += 1
+        opcodes = fused
+
+        # Opcode starts are sorted (difflib invariant); used to bisect past
+        # consumed opcodes after a structural list swap.
+        opcode_i1s = [op[1] for op in opcodes]
+        opcode_j1s = [op[3] for op in opcodes]
 
         k = 0
         while k < len(opcodes):
@@ -980,25 +1313,26 @@ class StreamDiffer(object):
 
                     if found_structural and old_p_atoms and new_li_atoms:
                         with self.diff_group():
-                            diff_id = self._new_diff_id() if getattr(self.config, 'add_diff_ids', False) else None
+                            diff_id = self._new_diff_id() if self._add_diff_ids else None
 
                             # Emit hidden <del class="structural-revert-data"> with old <p> events
-                            revert_events = concat_events(old_p_atoms)
-                            del_attrs = Attrs([(QName('class'), 'structural-revert-data'),
-                                               (QName('style'), 'display:none')])
+                            del_attrs = Attrs([(_Q_CLASS, 'structural-revert-data'),
+                                               (_Q_STYLE, 'display:none')])
                             if diff_id:
-                                del_attrs = del_attrs | [(QName(getattr(self.config, 'diff_id_attr', 'data-diff-id')), diff_id)]
-                            self.append(START, (QName('del'), del_attrs), (None, -1, -1))
-                            for ev in revert_events:
-                                self.append(*ev)
-                            self.append(END, QName('del'), (None, -1, -1))
+                                del_attrs = del_attrs | [(self._q_diff_id, diff_id)]
+                            self.append(START, (_Q_DEL, del_attrs), (None, -1, -1))
+                            # Stream straight from the atoms; no need to
+                            # materialize the whole old event list first.
+                            for atom in old_p_atoms:
+                                self.extend_raw(atom['events'])
+                            self.append(END, _Q_DEL, (None, -1, -1))
 
                             # Emit <ol/ul class="tagdiff_added">
                             list_qname = list_start_ev[1][0]
                             list_attrs = list_start_ev[1][1]
                             list_attrs = self.inject_class(list_attrs, 'tagdiff_added')
                             if diff_id:
-                                list_attrs = self._set_attr(list_attrs, getattr(self.config, 'diff_id_attr', 'data-diff-id'), diff_id)
+                                list_attrs = self._set_attr(list_attrs, self._diff_id_attr, diff_id)
                             self.enter(list_start_ev[2], list_qname, list_attrs)
 
                             # Build old sentence lookup for inner diffing.
@@ -1094,7 +1428,7 @@ class StreamDiffer(object):
                                     matched_old = li_matched.get(li_idx)
 
                                     if diff_id:
-                                        li_attrs = self._set_attr(li_attrs, getattr(self.config, 'diff_id_attr', 'data-diff-id'), diff_id)
+                                        li_attrs = self._set_attr(li_attrs, self._diff_id_attr, diff_id)
                                     self.enter(li_evs[0][2], li_tag, li_attrs)
 
                                     if matched_old:
@@ -1111,39 +1445,38 @@ class StreamDiffer(object):
                                                     del_inner_id = self._new_diff_id() if diff_id else None
                                                     del_a = Attrs()
                                                     if del_inner_id:
-                                                        del_a = del_a | [(QName(getattr(self.config, 'diff_id_attr', 'data-diff-id')), del_inner_id)]
-                                                    self.append(START, (QName('del'), del_a), (None, -1, -1))
+                                                        del_a = del_a | [(self._q_diff_id, del_inner_id)]
+                                                    self.append(START, (_Q_DEL, del_a), (None, -1, -1))
                                                     self.append(TEXT, ' '.join(old_words[wi1:wi2]), (None, -1, -1))
-                                                    self.append(END, QName('del'), (None, -1, -1))
+                                                    self.append(END, _Q_DEL, (None, -1, -1))
                                                     ins_a = Attrs()
                                                     if del_inner_id:
-                                                        ins_a = ins_a | [(QName(getattr(self.config, 'diff_id_attr', 'data-diff-id')), del_inner_id)]
-                                                    self.append(START, (QName('ins'), ins_a), (None, -1, -1))
+                                                        ins_a = ins_a | [(self._q_diff_id, del_inner_id)]
+                                                    self.append(START, (_Q_INS, ins_a), (None, -1, -1))
                                                     self.append(TEXT, ' '.join(new_words[wj1:wj2]), (None, -1, -1))
-                                                    self.append(END, QName('ins'), (None, -1, -1))
+                                                    self.append(END, _Q_INS, (None, -1, -1))
                                                     self.append(TEXT, ' ', (None, -1, -1))
                                                 elif wop == 'delete':
                                                     del_inner_id = self._new_diff_id() if diff_id else None
                                                     del_a = Attrs()
                                                     if del_inner_id:
-                                                        del_a = del_a | [(QName(getattr(self.config, 'diff_id_attr', 'data-diff-id')), del_inner_id)]
-                                                    self.append(START, (QName('del'), del_a), (None, -1, -1))
+                                                        del_a = del_a | [(self._q_diff_id, del_inner_id)]
+                                                    self.append(START, (_Q_DEL, del_a), (None, -1, -1))
                                                     self.append(TEXT, ' '.join(old_words[wi1:wi2]), (None, -1, -1))
-                                                    self.append(END, QName('del'), (None, -1, -1))
+                                                    self.append(END, _Q_DEL, (None, -1, -1))
                                                     self.append(TEXT, ' ', (None, -1, -1))
                                                 elif wop == 'insert':
                                                     ins_inner_id = self._new_diff_id() if diff_id else None
                                                     ins_a = Attrs()
                                                     if ins_inner_id:
-                                                        ins_a = ins_a | [(QName(getattr(self.config, 'diff_id_attr', 'data-diff-id')), ins_inner_id)]
-                                                    self.append(START, (QName('ins'), ins_a), (None, -1, -1))
+                                                        ins_a = ins_a | [(self._q_diff_id, ins_inner_id)]
+                                                    self.append(START, (_Q_INS, ins_a), (None, -1, -1))
                                                     self.append(TEXT, ' '.join(new_words[wj1:wj2]), (None, -1, -1))
-                                                    self.append(END, QName('ins'), (None, -1, -1))
+                                                    self.append(END, _Q_INS, (None, -1, -1))
                                                     self.append(TEXT, ' ', (None, -1, -1))
                                     else:
                                         # No change or no match — emit text as-is
-                                        for ev in li_evs[1:-1]:
-                                            self.append(*ev)
+                                        self.extend_raw(li_evs[1:-1])
                                     self.leave(li_evs[-1][2], li_evs[-1][1])
 
                             # Close ol/ul
@@ -1236,14 +1569,14 @@ class StreamDiffer(object):
 
                                 if old_li_atoms and new_p_atoms:
                                     with self.diff_group():
-                                        diff_id = self._new_diff_id() if getattr(self.config, 'add_diff_ids', False) else None
+                                        diff_id = self._new_diff_id() if self._add_diff_ids else None
 
                                         # Emit <ol/ul class="tagdiff_deleted">
                                         list_qname = list_start_ev[1][0]
                                         list_attrs = list_start_ev[1][1]
                                         list_attrs = self.inject_class(list_attrs, 'tagdiff_deleted')
                                         if diff_id:
-                                            list_attrs = self._set_attr(list_attrs, getattr(self.config, 'diff_id_attr', 'data-diff-id'), diff_id)
+                                            list_attrs = self._set_attr(list_attrs, self._diff_id_attr, diff_id)
                                         self.enter(list_start_ev[2], list_qname, list_attrs)
 
                                         # Emit each <li class="diff-bullet-del">
@@ -1254,25 +1587,23 @@ class StreamDiffer(object):
                                                 li_attrs = li_evs[0][1][1]
                                                 li_attrs = self.inject_class(li_attrs, 'diff-bullet-del')
                                                 if diff_id:
-                                                    li_attrs = self._set_attr(li_attrs, getattr(self.config, 'diff_id_attr', 'data-diff-id'), diff_id)
+                                                    li_attrs = self._set_attr(li_attrs, self._diff_id_attr, diff_id)
                                                 self.enter(li_evs[0][2], li_tag, li_attrs)
-                                                for ev in li_evs[1:-1]:
-                                                    self.append(*ev)
+                                                self.extend_raw(li_evs[1:-1])
                                                 self.leave(li_evs[-1][2], li_evs[-1][1])
 
                                         # Close ol/ul
                                         self.leave(end_ev[2], end_ev[1])
 
                                         # Emit hidden <ins class="structural-revert-data"> with new <p> events
-                                        revert_events = concat_events(new_p_atoms)
-                                        ins_attrs = Attrs([(QName('class'), 'structural-revert-data'),
-                                                           (QName('style'), 'display:none')])
+                                        ins_attrs = Attrs([(_Q_CLASS, 'structural-revert-data'),
+                                                           (_Q_STYLE, 'display:none')])
                                         if diff_id:
-                                            ins_attrs = ins_attrs | [(QName(getattr(self.config, 'diff_id_attr', 'data-diff-id')), diff_id)]
-                                        self.append(START, (QName('ins'), ins_attrs), (None, -1, -1))
-                                        for ev in revert_events:
-                                            self.append(*ev)
-                                        self.append(END, QName('ins'), (None, -1, -1))
+                                            ins_attrs = ins_attrs | [(self._q_diff_id, diff_id)]
+                                        self.append(START, (_Q_INS, ins_attrs), (None, -1, -1))
+                                        for atom in new_p_atoms:
+                                            self.extend_raw(atom['events'])
+                                        self.append(END, _Q_INS, (None, -1, -1))
 
                                     k = scan_k + 1
                                     found_structural = True
@@ -1283,310 +1614,318 @@ class StreamDiffer(object):
                     if found_structural:
                         continue
 
-            # Pair structural list conversions even when SequenceMatcher emits delete+insert
-            # as separate opcodes (not the same anchor => not normalized into replace).
-            if tag in ("delete", "insert") and k + 1 < len(opcodes):
-                tag2, i1b, i2b, j1b, j2b = opcodes[k + 1]
-                if tag == "delete" and tag2 == "insert":
-                    old_events = concat_events(self._old_atoms[i1:i2])
-                    new_events = concat_events(self._new_atoms[j1b:j2b])
-                    if _has_list_tags(old_events) != _has_list_tags(new_events):
-                        if _count_block_wrappers(old_events) <= 1 and _count_block_wrappers(new_events) <= 2:
-                            with self.diff_group():
-                                with self.context("del"):
-                                    self.block_process(old_events)
-                                with self.context("ins"):
-                                    self.block_process(new_events)
-                            k += 2
-                            continue
-                if tag == "insert" and tag2 == "delete":
-                    old_events = concat_events(self._old_atoms[i1b:i2b])
-                    new_events = concat_events(self._new_atoms[j1:j2])
-                    if _has_list_tags(old_events) != _has_list_tags(new_events):
-                        if _count_block_wrappers(old_events) <= 1 and _count_block_wrappers(new_events) <= 2:
-                            with self.diff_group():
-                                with self.context("del"):
-                                    self.block_process(old_events)
-                                with self.context("ins"):
-                                    self.block_process(new_events)
-                            k += 2
-                            continue
+            # Structural list conversions paired by the pre-pass above, even
+            # when SequenceMatcher emitted delete+insert as separate opcodes
+            # (not the same anchor => not normalized into replace).
+            if tag == 'list_conv':
+                # Concatenar recién cuando la rama se toma.
+                old_events = concat_events(self._old_atoms, i1, i2)
+                new_events = concat_events(self._new_atoms, j1, j2)
+                with self.diff_group():
+                    with self.context("del"):
+                        self.block_process(old_events)
+                    with self.context("ins"):
+                        self.block_process(new_events)
+                k += 1
+                continue
 
             if tag == 'replace':
+                # El matcher puede emitir 'replace' espurio con claves
+                # idénticas (desempates/heurísticas); en rangos chicos un
+                # chequeo elemento a elemento lo degrada a 'equal' y ahorra
+                # el diff interno completo.
+                span = i2 - i1
+                if span == (j2 - j1) and span <= 4 and all(
+                        self._old_atoms[i1 + off]['key'] == self._new_atoms[j1 + off]['key']
+                        for off in range(span)):
+                    self._process_equal_opcode(i1, i2, j1, j2)
+                    k += 1
+                    continue
+
                 # Special Check: Attribute-only change on a structural start tag?
                 # Pattern: replace(START) where tag names match and is structural.
                 # This avoids nesting (e.g. <ul deleted><ul added>...</ul></ul>).
                 if (i2 - i1) == 1 and (j2 - j1) == 1:
                     old_atom = self._old_atoms[i1]
                     new_atom = self._new_atoms[j1]
-                    old_evs = old_atom.get('events', [])
-                    new_evs = new_atom.get('events', [])
-                    
-                    if len(old_evs) == 1 and len(new_evs) == 1:
-                        old_ev = old_evs[0]
-                        new_ev = new_evs[0]
-                        if old_ev[0] == START and new_ev[0] == START:
-                            (old_t, old_attrs) = old_ev[1]
-                            (new_t, new_attrs) = new_ev[1]
-                            structural_tags = ('table', 'thead', 'tbody', 'tfoot', 'tr', 'td', 'th', 'ul', 'ol', 'li')
-                            lname = qname_localname(old_t)
-                            new_lname = qname_localname(new_t)
-                            
-                            # Allow same-tag replacement OR specific structural tag swaps (ul <-> ol)
-                            # This allows granular diffs inside the list (since we don't force block atomization)
-                            # while maintaining valid HTML structure by just replacing the container tag.
-                            is_allowed_swap = (lname == new_lname) or (lname in ('ul', 'ol') and new_lname in ('ul', 'ol'))
-                            
-                            if is_allowed_swap and lname in structural_tags and new_lname in structural_tags:
-                                if lname in ('ul', 'ol') and new_lname in ('ul', 'ol'):
-                                    # List type/style change (ol↔ul swap or same-tag attr change)
-                                    # Use structural diff: diff-bullet-ins + structural-revert-data
-                                    end_idx_old = None
-                                    end_idx_new = None
-                                    # Find END atom for old list (search for old tag name)
-                                    depth = 1
-                                    for oi in range(i1 + 1, len(self._old_atoms)):
-                                        for ev in self._old_atoms[oi].get('events', []):
-                                            if ev[0] == START and qname_localname(ev[1][0]) == lname:
-                                                depth += 1
-                                            elif ev[0] == END and qname_localname(ev[1]) == lname:
-                                                depth -= 1
-                                                if depth == 0:
-                                                    end_idx_old = oi
-                                        if end_idx_old is not None:
-                                            break
-                                    # Find END atom for new list (use new_lname for ul↔ol case)
-                                    depth = 1
-                                    for ni in range(j1 + 1, len(self._new_atoms)):
-                                        for ev in self._new_atoms[ni].get('events', []):
-                                            if ev[0] == START and qname_localname(ev[1][0]) == new_lname:
-                                                depth += 1
-                                            elif ev[0] == END and qname_localname(ev[1]) == new_lname:
-                                                depth -= 1
-                                                if depth == 0:
-                                                    end_idx_new = ni
-                                        if end_idx_new is not None:
-                                            break
-
-                                    if end_idx_old is not None and end_idx_new is not None:
-                                        # Collect old list atoms (full list) for revert data
-                                        old_list_atoms = self._old_atoms[i1:end_idx_old + 1]
-                                        # Collect new LI atoms for bullet display
-                                        new_li_atoms = [a for a in self._new_atoms[j1 + 1:end_idx_new]
-                                                        if a.get('tag') == 'li']
-                                        # Collect old LI atoms for attr comparison
-                                        old_li_atoms = [a for a in self._old_atoms[i1 + 1:end_idx_old]
-                                                        if a.get('tag') == 'li']
-
-                                        if new_li_atoms:
-                                            with self.diff_group():
-                                                diff_id = self._new_diff_id() if getattr(self.config, 'add_diff_ids', False) else None
-
-                                                # Emit hidden <del class="structural-revert-data"> with old list
-                                                revert_events = concat_events(old_list_atoms)
-                                                del_attrs = Attrs([(QName('class'), 'structural-revert-data'),
-                                                                   (QName('style'), 'display:none')])
-                                                if diff_id:
-                                                    del_attrs = del_attrs | [(QName(getattr(self.config, 'diff_id_attr', 'data-diff-id')), diff_id)]
-                                                self.append(START, (QName('del'), del_attrs), (None, -1, -1))
-                                                for ev in revert_events:
-                                                    self.append(*ev)
-                                                self.append(END, QName('del'), (None, -1, -1))
-
-                                                # Determine if this is a bullet-visual change:
-                                                # - tag swap (ul↔ol): bullets change (dots→numbers)
-                                                # - list-style-type changed: bullets change (1,2,3→I,II,III)
-                                                # Font/color-only changes are NOT bullet changes.
-                                                def _get_lst(style_val):
-                                                    for p in (style_val or '').split(';'):
-                                                        p = p.strip()
-                                                        if p.lower().startswith('list-style-type'):
-                                                            return p.split(':', 1)[1].strip().lower()
-                                                    return None
-                                                old_lst = _get_lst(old_attrs.get('style'))
-                                                new_lst = _get_lst(new_ev[1][1].get('style'))
+                    # _sssl viene precalculado de la atomización: es el
+                    # localname solo cuando el átomo es exactamente un START
+                    # estructural; dos gets reemplazan la inspección de
+                    # eventos + qname_localname por opcode de replace.
+                    lname = old_atom['_sssl']
+                    new_lname = new_atom['_sssl']
+
+                    if lname is not None and new_lname is not None:
+                        old_ev = old_atom['events'][0]
+                        new_ev = new_atom['events'][0]
+                        (old_t, old_attrs) = old_ev[1]
+                        (new_t, new_attrs) = new_ev[1]
+
+                        # Allow same-tag replacement OR specific structural tag swaps (ul <-> ol)
+                        # This allows granular diffs inside the list (since we don't force block atomization)
+                        # while maintaining valid HTML structure by just replacing the container tag.
+                        is_allowed_swap = (lname == new_lname) or (lname in ('ul', 'ol') and new_lname in ('ul', 'ol'))
+
+                        if is_allowed_swap:
+                            if lname in ('ul', 'ol') and new_lname in ('ul', 'ol'):
+                                # List type/style change (ol↔ul swap or same-tag attr change)
+                                # Use structural diff: diff-bullet-ins + structural-revert-data
+                                # END atoms for old/new lists via the precomputed
+                                # index maps (handles the ul↔ol swap case too).
+                                end_idx_old = old_list_ends.get(i1)
+                                end_idx_new = new_list_ends.get(j1)
+
+                                if end_idx_old is not None and end_idx_new is not None:
+                                    # Collect old list atoms (full list) for revert data
+                                    old_list_atoms = self._old_atoms[i1:end_idx_old + 1]
+                                    # Collect new LI atoms for bullet display
+                                    new_li_atoms = [a for a in self._new_atoms[j1 + 1:end_idx_new]
+                                                    if a.get('tag') == 'li']
+                                    # Collect old LI atoms for attr comparison
+                                    old_li_atoms = [a for a in self._old_atoms[i1 + 1:end_idx_old]
+                                                    if a.get('tag') == 'li']
+
+                                    if new_li_atoms:
+                                        with self.diff_group():
+                                            diff_id = self._new_diff_id() if self._add_diff_ids else None
+                                            diff_id_qname = self._q_diff_id
+
+                                            # Emit hidden <del class="structural-revert-data"> with old list
+                                            del_attrs = Attrs([(_Q_CLASS, 'structural-revert-data'),
+                                                               (_Q_STYLE, 'display:none')])
+                                            if diff_id:
+                                                del_attrs = del_attrs | [(self._q_diff_id, diff_id)]
+                                            self.append(START, (_Q_DEL, del_attrs), (None, -1, -1))
+                                            for atom in old_list_atoms:
+                                                self.extend_raw(atom['events'])
+                                            self.append(END, _Q_DEL, (None, -1, -1))
+
+                                            # Determine if this is a bullet-visual change:
+                                            # - tag swap (ul↔ol): bullets change (dots→numbers)
+                                            # - list-style-type changed: bullets change (1,2,3→I,II,III)
+                                            # Font/color-only changes are NOT bullet changes.
+                                            def _get_lst(style_val):
+                                                for p in (style_val or '').split(';'):
+                                                    p = p.strip()
+                                                    if p.lower().startswith('list-style-type'):
+                                                        return p.split(':', 1)[1].strip().lower()
+                                                return None
+                                            old_style_raw = old_attrs.get('style')
+                                            new_style_raw = new_ev[1][1].get('style')
+                                            if old_style_raw == new_style_raw:
+                                                # Identical style strings: list-style-type
+                                                # cannot differ, skip both parses.
+                                                is_bullet_change = (old_t != new_t)
+                                            else:
+                                                old_lst = _get_lst(old_style_raw)
+                                                new_lst = _get_lst(new_style_raw)
                                                 is_bullet_change = (old_t != new_t) or (old_lst != new_lst and (old_lst is not None or new_lst is not None))
 
-                                                # Emit new list with appropriate class
-                                                list_qname = new_ev[1][0]
-                                                list_attrs_new = new_ev[1][1]
-                                                if is_bullet_change:
-                                                    list_attrs_new = self.inject_class(list_attrs_new, 'tagdiff_added')
-                                                    if old_t != new_t:
-                                                        list_attrs_new = list_attrs_new | [(QName('data-old-tag'), qname_localname(old_t))]
-                                                else:
-                                                    list_attrs_new = self.inject_class(list_attrs_new, 'tagdiff_replaced')
-                                                # Track container attr changes (e.g. style: Arial→Comic Sans)
-                                                list_attrs_new = self.inject_refattr(list_attrs_new, old_attrs)
-                                                if diff_id:
-                                                    list_attrs_new = self._set_attr(list_attrs_new, getattr(self.config, 'diff_id_attr', 'data-diff-id'), diff_id)
-                                                self.enter(new_ev[2], list_qname, list_attrs_new)
-
-                                                # Compute inherited style diff from list container
-                                                # (for propagating font changes down to li del/ins)
-                                                _INHERITABLE = ('font-family', 'font-size', 'font-style', 'font-weight', 'color')
-                                                old_list_style = old_attrs.get('style', '')
-                                                new_list_style = new_ev[1][1].get('style', '')
-                                                def _parse_css(s):
-                                                    d = {}
-                                                    for p in s.split(';'):
-                                                        p = p.strip()
-                                                        if ':' in p:
-                                                            k, v = p.split(':', 1)
-                                                            d[k.strip().lower()] = v.strip()
-                                                    return d
+                                            # Emit new list with appropriate class
+                                            list_qname = new_ev[1][0]
+                                            list_attrs_new = new_ev[1][1]
+                                            if is_bullet_change:
+                                                list_attrs_new = self.inject_class(list_attrs_new, 'tagdiff_added')
+                                                if old_t != new_t:
+                                                    list_attrs_new = list_attrs_new | [(_Q_OLD_TAG, qname_localname(old_t))]
+                                            else:
+                                                list_attrs_new = self.inject_class(list_attrs_new, 'tagdiff_replaced')
+                                            # Track container attr changes (e.g. style: Arial→Comic Sans)
+                                            list_attrs_new = self.inject_refattr(list_attrs_new, old_attrs)
+                                            if diff_id:
+                                                list_attrs_new = self._set_attr(list_attrs_new, self._diff_id_attr, diff_id)
+                                            self.enter(new_ev[2], list_qname, list_attrs_new)
+
+                                            # Compute inherited style diff from list container
+                                            # (for propagating font changes down to li del/ins)
+                                            _INHERITABLE = ('font-family', 'font-size', 'font-style', 'font-weight', 'color')
+                                            old_list_style = old_attrs.get('style', '')
+                                            new_list_style = new_ev[1][1].get('style', '')
+                                            def _parse_css(s):
+                                                d = {}
+                                                for p in s.split(';'):
+                                                    p = p.strip()
+                                                    if ':' in p:
+                                                        k, v = p.split(':', 1)
+                                                        d[k.strip().lower()] = v.strip()
+                                                return d
+                                            inherited_changed = {}
+                                            if old_list_style != new_list_style:
+                                                # Byte-identical styles cannot change any
+                                                # inheritable prop; only parse when they differ.
                                                 old_css = _parse_css(old_list_style)
                                                 new_css = _parse_css(new_list_style)
-                                                inherited_changed = {}
                                                 for prop in _INHERITABLE:
                                                     if old_css.get(prop) != new_css.get(prop) and (prop in old_css or prop in new_css):
                                                         # Use old value if it existed, otherwise 'initial'
                                                         # to prevent del from inheriting the new value
                                                         inherited_changed[prop] = old_css.get(prop) or 'initial'
 
-                                                # Emit each LI
-                                                for li_idx, li_atom in enumerate(new_li_atoms):
-                                                    li_evs = li_atom.get('events', [])
-                                                    if li_evs and li_evs[0][0] == START:
-                                                        li_tag = li_evs[0][1][0]
-                                                        li_attrs = li_evs[0][1][1]
-                                                        if is_bullet_change:
-                                                            li_attrs = self.inject_class(li_attrs, 'diff-bullet-ins')
-
-                                                        # Check if this LI has attr changes vs old
-                                                        old_li_evs = None
-                                                        li_style_changed = False
-                                                        if li_idx < len(old_li_atoms):
-                                                            old_li_evs = old_li_atoms[li_idx].get('events', [])
-                                                            if old_li_evs and old_li_evs[0][0] == START:
-                                                                old_li_attrs = old_li_evs[0][1][1]
-                                                                li_attrs = self.inject_refattr(li_attrs, old_li_attrs)
-                                                                li_style_changed = (old_li_attrs != li_evs[0][1][1])
-
-                                                        if diff_id:
-                                                            li_attrs = self._set_attr(li_attrs, getattr(self.config, 'diff_id_attr', 'data-diff-id'), diff_id)
-                                                        self.enter(li_evs[0][2], li_tag, li_attrs)
-
-                                                        if li_style_changed and old_li_evs:
-                                                            # Style changed: inline del(old style) + ins(new style)
-                                                            # Put old style on <del> so text renders with old font
-                                                            old_style_val = old_li_attrs.get('style')
-                                                            with self.diff_group():
-                                                                del_tag_attrs = Attrs()
-                                                                if old_style_val:
-                                                                    del_tag_attrs = del_tag_attrs | [(QName('style'), old_style_val)]
-                                                                if diff_id:
-                                                                    del_tag_attrs = del_tag_attrs | [(QName(getattr(self.config, 'diff_id_attr', 'data-diff-id')), self._new_diff_id())]
-                                                                self.append(START, (QName('del'), del_tag_attrs), (None, -1, -1))
-                                                                for ev in old_li_evs[1:-1]:
-                                                                    self.append(*ev)
-                                                                self.append(END, QName('del'), (None, -1, -1))
-
-                                                                ins_tag_attrs = Attrs()
-                                                                if diff_id:
-                                                                    ins_tag_attrs = ins_tag_attrs | [(QName(getattr(self.config, 'diff_id_attr', 'data-diff-id')), self._new_diff_id())]
-                                                                self.append(START, (QName('ins'), ins_tag_attrs), (None, -1, -1))
-                                                                for ev in li_evs[1:-1]:
-                                                                    self.append(*ev)
-                                                                self.append(END, QName('ins'), (None, -1, -1))
-                                                        elif old_li_evs and old_li_evs[1:-1] != li_evs[1:-1]:
-                                                            # Inner content changed (e.g. <i> wrapper): use EventDiffer
-                                                            inner = _EventDiffer(old_li_evs[1:-1], li_evs[1:-1], self.config, diff_id_state=self._diff_id_state)
-                                                            for ev in inner.get_diff_events():
-                                                                self.append(*ev)
-                                                        elif inherited_changed and old_li_evs:
-                                                            # List container style changed with inheritable props
-                                                            # (e.g. font-family added) but li content is identical.
-                                                            # Emit del(old inherited style)/ins.
-                                                            old_li_style = old_li_attrs.get('style', '') if li_idx < len(old_li_atoms) else ''
-                                                            old_li_css = _parse_css(old_li_style)
-                                                            # Add inherited props that the old li didn't explicitly have
-                                                            merged = dict(old_li_css)
-                                                            for prop, val in inherited_changed.items():
-                                                                if prop not in merged:
-                                                                    merged[prop] = val
-                                                            merged_style = '; '.join(f'{k}: {v}' for k, v in merged.items()) if merged else ''
-                                                            with self.diff_group():
-                                                                del_tag_attrs = Attrs()
-                                                                if merged_style:
-                                                                    del_tag_attrs = del_tag_attrs | [(QName('style'), merged_style)]
-                                                                if diff_id:
-                                                                    del_tag_attrs = del_tag_attrs | [(QName(getattr(self.config, 'diff_id_attr', 'data-diff-id')), self._new_diff_id())]
-                                                                self.append(START, (QName('del'), del_tag_attrs), (None, -1, -1))
-                                                                for ev in old_li_evs[1:-1]:
-                                                                    self.append(*ev)
-                                                                self.append(END, QName('del'), (None, -1, -1))
-                                                                ins_tag_attrs = Attrs()
-                                                                if diff_id:
-                                                                    ins_tag_attrs = ins_tag_attrs | [(QName(getattr(self.config, 'diff_id_attr', 'data-diff-id')), self._new_diff_id())]
-                                                                self.append(START, (QName('ins'), ins_tag_attrs), (None, -1, -1))
-                                                                for ev in li_evs[1:-1]:
-                                                                    self.append(*ev)
-                                                                self.append(END, QName('ins'), (None, -1, -1))
-                                                        else:
-                                                            # No change: just emit content directly
-                                                            for ev in li_evs[1:-1]:
-                                                                self.append(*ev)
-
-                                                        self.leave(li_evs[-1][2], li_evs[-1][1])
-
-                                                # Close list
-                                                end_ev_atoms = self._new_atoms[end_idx_new].get('events', [])
-                                                if end_ev_atoms:
-                                                    self.leave(end_ev_atoms[0][2], end_ev_atoms[0][1])
-
-                                            # Skip all consumed opcodes
-                                            # but preserve any trailing atoms that extend past the list end
-                                            tail_old_start = None
-                                            tail_new_start = None
-                                            tail_tag = None
-                                            while k + 1 < len(opcodes):
-                                                next_tag, next_i1, next_i2, next_j1, next_j2 = opcodes[k + 1]
-                                                if next_i1 <= end_idx_old or next_j1 <= end_idx_new:
-                                                    # This opcode overlaps with the list — check if it extends past
-                                                    if next_i2 > end_idx_old + 1 or next_j2 > end_idx_new + 1:
-                                                        # Opcode extends past the list end — save tail boundaries
-                                                        tail_old_start = max(next_i1, end_idx_old + 1)
-                                                        tail_new_start = max(next_j1, end_idx_new + 1)
-                                                        tail_tag = next_tag
-                                                        tail_old_end = next_i2
-                                                        tail_new_end = next_j2
-                                                    k += 1
-                                                else:
+                                            # Emit each LI, co-iterating with the old LIs
+                                            # (zip_longest avoids indexing + bounds checks).
+                                            for li_atom, old_li_atom in zip_longest(new_li_atoms, old_li_atoms):
+                                                if li_atom is None:
+                                                    # Extra old LIs are already covered by
+                                                    # the revert data emitted above.
                                                     break
+                                                li_evs = li_atom.get('events', [])
+                                                if li_evs and li_evs[0][0] == START:
+                                                    li_tag = li_evs[0][1][0]
+                                                    li_attrs = li_evs[0][1][1]
+                                                    if is_bullet_change:
+                                                        li_attrs = self.inject_class(li_attrs, 'diff-bullet-ins')
+
+                                                    # Check if this LI has attr changes vs old
+                                                    old_li_evs = None
+                                                    li_style_changed = False
+                                                    if old_li_atom is not None:
+                                                        old_li_evs = old_li_atom.get('events', [])
+                                                        if old_li_evs and old_li_evs[0][0] == START:
+                                                            old_li_attrs = old_li_evs[0][1][1]
+                                                            li_attrs = self.inject_refattr(li_attrs, old_li_attrs)
+                                                            li_style_changed = (old_li_attrs != li_evs[0][1][1])
+
+                                                    if diff_id:
+                                                        li_attrs = self._set_attr(li_attrs, self._diff_id_attr, diff_id)
+                                                    self.enter(li_evs[0][2], li_tag, li_attrs)
+
+                                                    # Slice the inner events once; they are
+                                                    # compared and emitted multiple times below.
+                                                    inner_new = li_evs[1:-1]
+                                                    inner_old = old_li_evs[1:-1] if old_li_evs else None
+
+                                                    if li_style_changed and old_li_evs:
+                                                        # Style changed: inline del(old style) + ins(new style)
+                                                        # Put old style on <del> so text renders with old font
+                                                        old_style_val = old_li_attrs.get('style')
+                                                        with self.diff_group():
+                                                            # Gather attr pairs in a plain list and build
+                                                            # Attrs once (avoids one allocation per `|`).
+                                                            del_pairs = []
+                                                            if old_style_val:
+                                                                del_pairs.append((_Q_STYLE, old_style_val))
+                                                            if diff_id:
+                                                                del_pairs.append((diff_id_qname, self._new_diff_id()))
+                                                            self.append(START, (_Q_DEL, Attrs(del_pairs)), (None, -1, -1))
+                                                            self.extend_raw(inner_old)
+                                                            self.append(END, _Q_DEL, (None, -1, -1))
+
+                                                            ins_pairs = []
+                                                            if diff_id:
+                                                                ins_pairs.append((diff_id_qname, self._new_diff_id()))
+                                                            self.append(START, (_Q_INS, Attrs(ins_pairs)), (None, -1, -1))
+                                                            self.extend_raw(inner_new)
+                                                            self.append(END, _Q_INS, (None, -1, -1))
+                                                    elif old_li_evs and inner_old != inner_new:
+                                                        # Inner content changed (e.g. <i> wrapper): use EventDiffer
+                                                        self.extend_raw(self._inner_diff_events(inner_old, inner_new))
+                                                    elif inherited_changed and old_li_evs:
+                                                        # List container style changed with inheritable props
+                                                        # (e.g. font-family added) but li content is identical.
+                                                        # Emit del(old inherited style)/ins.
+                                                        old_li_style = old_li_attrs.get('style', '') if old_li_atom is not None else ''
+                                                        old_li_css = _parse_css(old_li_style)
+                                                        # Add inherited props that the old li didn't explicitly have
+                                                        merged = dict(old_li_css)
+                                                        for prop, val in inherited_changed.items():
+                                                            if prop not in merged:
+                                                                merged[prop] = val
+                                                        # Typically 1-4 props; plain concatenation into a
+                                                        # list beats the generator + f-string protocol here.
+                                                        if merged:
+                                                            style_parts = []
+                                                            for mk, mv in merged.items():
+                                                                style_parts.append(mk + ': ' + mv)
+                                                            merged_style = '; '.join(style_parts)
+                                                        else:
+                                                            merged_style = ''
+                                                        with self.diff_group():
+                                                            del_pairs = []
+                                                            if merged_style:
+                                                                del_pairs.append((_Q_STYLE, merged_style))
+                                                            if diff_id:
+                                                                del_pairs.append((diff_id_qname, self._new_diff_id()))
+                                                            self.append(START, (_Q_DEL, Attrs(del_pairs)), (None, -1, -1))
+                                                            self.extend_raw(inner_old)
+                                                            self.append(END, _Q_DEL, (None, -1, -1))
+                                                            ins_pairs = []
+                                                            if diff_id:
+                                                                ins_pairs.append((diff_id_qname, self._new_diff_id()))
+                                                            self.append(START, (_Q_INS, Attrs(ins_pairs)), (None, -1, -1))
+                                                            self.extend_raw(inner_new)
+                                                            self.append(END, _Q_INS, (None, -1, -1))
+                                                    else:
+                                                        # No change: just emit content directly
+                                                        self.extend_raw(inner_new)
+
+                                                    self.leave(li_evs[-1][2], li_evs[-1][1])
+
+                                            # Close list
+                                            end_ev_atoms = self._new_atoms[end_idx_new].get('events', [])
+                                            if end_ev_atoms:
+                                                self.leave(end_ev_atoms[0][2], end_ev_atoms[0][1])
+
+                                        # Skip all consumed opcodes via bisect on the sorted
+                                        # opcode starts (instead of walking them one by one),
+                                        # but preserve any trailing atoms that extend past
+                                        # the list end.
+                                        tail_old_start = None
+                                        tail_new_start = None
+                                        tail_tag = None
+                                        cut = max(bisect_right(opcode_i1s, end_idx_old, k + 1),
+                                                  bisect_right(opcode_j1s, end_idx_new, k + 1))
+                                        # Only the last consumed opcode can carry a tail past
+                                        # the list end; scan backwards for it.
+                                        for m in range(cut - 1, k, -1):
+                                            m_tag, m_i1, m_i2, m_j1, m_j2 = opcodes[m]
+                                            if m_i2 > end_idx_old + 1 or m_j2 > end_idx_new + 1:
+                                                tail_old_start = max(m_i1, end_idx_old + 1)
+                                                tail_new_start = max(m_j1, end_idx_new + 1)
+                                                tail_tag = m_tag
+                                                tail_old_end = m_i2
+                                                tail_new_end = m_j2
+                                                break
+                                        k = cut - 1
+
+                                        # Emit any trailing atoms from the partially-consumed opcode
+                                        if tail_old_start is not None and tail_tag == 'equal':
+                                            self._process_equal_opcode(tail_old_start, tail_old_end,
+                                                                       tail_new_start, tail_new_end)
+                                        k += 1
+                                        continue
 
-                                            # Emit any trailing atoms from the partially-consumed opcode
-                                            if tail_old_start is not None and tail_tag == 'equal':
-                                                tail_old_atoms = self._old_atoms[tail_old_start:tail_old_end]
-                                                tail_new_atoms = self._new_atoms[tail_new_start:tail_new_end]
-                                                self._process_equal_opcode(tail_old_atoms, tail_new_atoms)
-                                            k += 1
-                                            continue
-
-                                elif lname == new_lname and old_attrs != new_attrs:
-                                    # Other structural tags (table, tr, etc) - use tagdiff_replaced
-                                    self.enter_mark_replaced(new_ev[2], new_t, new_attrs, old_attrs, old_tag=old_t)
-                                    k += 1
-                                    continue
+                            elif lname == new_lname and old_attrs != new_attrs:
+                                # Other structural tags (table, tr, etc) - use tagdiff_replaced
+                                self.enter_mark_replaced(new_ev[2], new_t, new_attrs, old_attrs, old_tag=old_t)
+                                k += 1
+                                continue
 
-                self._process_replace_opcode(self._old_atoms[i1:i2], self._new_atoms[j1:j2])
+                self._process_replace_opcode(i1, i2, j1, j2)
             elif tag == 'delete':
                 with self.diff_group():
                     with self.context('del'):
-                        self.block_process(concat_events(self._old_atoms[i1:i2]))
+                        self.block_process(concat_events(self._old_atoms, i1, i2))
             elif tag == 'insert':
                 with self.diff_group():
                     with self.context('ins'):
-                        self.block_process(concat_events(self._new_atoms[j1:j2]))
+                        self.block_process(concat_events(self._new_atoms, j1, j2))
             else:  # equal
-                self._process_equal_opcode(self._old_atoms[i1:i2], self._new_atoms[j1:j2])
+                self._process_equal_opcode(i1, i2, j1, j2)
             k += 1
         self.leave_all()
 
     def get_diff_stream(self):
         if self._result is None:
             self.process()
-        if getattr(self.config, 'merge_adjacent_change_tags', True):
+            # Las claves id() dejan de ser estables una vez que los átomos
+            # pueden ser liberados; soltar los caches junto con el diff.
+            self._sig_cache.clear()
+            self._vis_repl_cache.clear()
+            self._inner_diff_cache.clear()
+        # Sin marcadores emitidos no hay nada que fusionar: los documentos
+        # que pasaron de largo (idénticos o con cambios solo de atributos)
+        # se devuelven sin la segunda pasada sobre todos los eventos.
+        if self._emitted_change_markers and getattr(self.config, 'merge_adjacent_change_tags', True):
             self._result = merge_adjacent_change_tags(self._result, config=self.config)
         return Stream(self._result)
 
@@ -16,7 +16,7 @@ from genshi.core import QName, Attrs, START, END, TEXT
 
 from .config import DiffConfig, INLINE_FORMATTING_TAGS
 from .utils import (
-    qname_localname, collapse_ws, has_visual_attrs
+    qname_localname, collapse_ws, has_visual_attrs, compute_opcodes
 )
 from .normalization import (
     normalize_opcodes_for_delete_first,
@@ -39,13 +39,23 @@ def create_event_differ_class(StreamDiffer):
         It bypasses atomization to avoid recursive re-grouping side-effects.
         """
 
+        # StreamDiffer declara __slots__; no agregamos atributos nuevos.
+        __slots__ = ()
+
         def __init__(self, old_events, new_events, config, diff_id_state=None):
             self.config = config or DiffConfig()
+            self._add_diff_ids = getattr(self.config, 'add_diff_ids', False)
+            self._diff_id_attr = getattr(self.config, 'diff_id_attr', 'data-diff-id')
+            self._track_attrs = tuple(getattr(self.config, 'track_attrs', ('style', 'class', 'src', 'href')))
+            self._preserve_ws = getattr(self.config, 'preserve_whitespace_in_diff', True)
+            self._q_diff_id = QName(self._diff_id_attr)
+            self._force_tags = frozenset(getattr(self.config, 'force_event_diff_on_equal_for_tags', ()))
+            self._wrap_void = frozenset(getattr(self.config, 'wrap_void_tag_changes_with_ins_del', ()) or ())
             # IMPORTANT: Keep original TEXT events intact and let diff_text() handle
             # word-level granularity. Splitting TEXT here can cause insertions to
             # appear "inside" deletions for phrase replacements.
-            self._old_events = list(old_events)
-            self._new_events = list(new_events)
+            self._old_events = old_events if isinstance(old_events, list) else list(old_events)
+            self._new_events = new_events if isinstance(new_events, list) else list(new_events)
             self._old_atoms = None
             self._new_atoms = None
             self._result = []
@@ -56,6 +66,34 @@ def create_event_differ_class(StreamDiffer):
             self._diff_id_state = diff_id_state if diff_id_state is not None else [0]
             self._diff_id_stack = []
             self._style_del_buffer = []
+            self._sig_cache = {}
+            self._vis_repl_cache = {}
+            self._inner = None
+            self._inner_diff_cache = {}
+            self._emitted_change_markers = False
+
+        def reset(self, old_events, new_events):
+            """
+            Reinicia la instancia para un nuevo diff interno (ver
+            StreamDiffer._get_inner). _result se reemplaza por una lista
+            nueva para no invalidar resultados ya devueltos; config y
+            diff_id_state se conservan.
+            """
+            self._old_events = old_events if isinstance(old_events, list) else list(old_events)
+            self._new_events = new_events if isinstance(new_events, list) else list(new_events)
+            self._result = []
+            del self._stack[:]
+            self._context = None
+            del self._skip_end_for[:]
+            del self._wrap_change_end_for[:]
+            del self._diff_id_stack[:]
+            del self._style_del_buffer[:]
+            self._sig_cache.clear()
+            self._vis_repl_cache.clear()
+            self._emitted_change_markers = False
+            # _inner_diff_cache se conserva: está indexada por contenido de
+            # eventos, no por id(), así que sigue siendo válida entre resets.
+            return self
 
         def get_diff_events(self):
             self.process_events()
@@ -121,22 +159,20 @@ def create_event_differ_class(StreamDiffer):
             old_cont_attrs = old_start_ev[1][1]
             self.enter_mark_replaced(new_start_ev[2], cont_tag, cont_attrs_new, old_cont_attrs)
             # whitespace between container and wrapper
-            for j in range(b1 + 1, wrapper_idx):
-                self.append(*self._new_events[j])
+            self.extend_raw(self._new_events[b1 + 1:wrapper_idx])
             # wrapper START marked replaced
             w_attrs2 = Attrs(list(wrapper_attrs))
             w_attrs2 = self.inject_class(w_attrs2, 'tagdiff_replaced')
             w_attrs2 |= [(QName('data-old-tag'), 'none')]
-            if getattr(self.config, 'add_diff_ids', False):
+            if self._add_diff_ids:
                 diff_id = self._active_diff_id() or self._new_diff_id()
-                w_attrs2 = self._set_attr(w_attrs2, getattr(self.config, 'diff_id_attr', 'data-diff-id'), diff_id)
+                w_attrs2 = self._set_attr(w_attrs2, self._diff_id_attr, diff_id)
             self.enter(self._new_events[wrapper_idx][2], wrapper_tag, w_attrs2)
             # shared TEXT once
             self.append(TEXT, old_text_ev[1], new_text_ev[2])
             # close wrapper and emit remaining insert tail (indentation)
             self.leave(end_ev[2], end_ev[1])
-            for j in range(f1 + 1, f2):
-                self.append(*self._new_events[j])
+            self.extend_raw(self._new_events[f1 + 1:f2])
             
             return True
 
@@ -149,8 +185,13 @@ def create_event_differ_class(StreamDiffer):
                 self.leave_all()
                 return
 
-            matcher = SequenceMatcher(None, self._old_events, self._new_events)
-            opcodes = matcher.get_opcodes()
+            # Internar eventos a enteros abarata el hash/eq repetido del
+            # matcher (los eventos son tuplas anidadas con QName/Attrs).
+            ev_to_id = {}
+            enc = ev_to_id.setdefault
+            old_ids = [enc(ev, len(ev_to_id)) for ev in self._old_events]
+            new_ids = [enc(ev, len(ev_to_id)) for ev in self._new_events]
+            opcodes = compute_opcodes(old_ids, new_ids)
             if getattr(self.config, 'delete_first', True):
                 opcodes = normalize_opcodes_for_delete_first(opcodes)
             opcodes = normalize_inline_wrapper_opcodes(opcodes, self._old_events, self._new_events)
@@ -7,13 +7,14 @@ It handles column insertion/deletion, row alignment, and cell-level diffs.
 """
 from __future__ import with_statement
 
-from difflib import SequenceMatcher
 from genshi.core import START, END, Attrs, QName
 
 from .utils import (
     qname_localname, collapse_ws, extract_text_from_events,
-    attrs_signature, structure_signature, normalize_style_value
+    attrs_signature, structure_signature, normalize_style_value,
+    compute_opcodes
 )
+from .atomization import find_block_end
 
 
 def _attrs_equal_normalized(attrs1, attrs2):
@@ -48,16 +49,7 @@ def extract_direct_tr_cells(tr_events):
             tag, attrs = data
             lname = qname_localname(tag)
             if lname in ('td', 'th'):
-                # Find matching END for this cell
-                depth = 1
-                j = i + 1
-                while j < n and depth:
-                    t2, d2, _p2 = tr_events[j]
-                    if t2 == START and qname_localname(d2[0]) == lname:
-                        depth += 1
-                    elif t2 == END and qname_localname(d2) == lname:
-                        depth -= 1
-                    j += 1
+                j = find_block_end(tr_events, i, lname)
                 block = tr_events[i:j]
                 cells.append({'tag': lname, 'events': block, 'attrs': attrs})
                 i = j
@@ -77,15 +69,7 @@ def extract_tr_blocks(table_events):
             tag, _attrs = data
             lname = qname_localname(tag)
             if lname == "tr":
-                depth = 1
-                j = i + 1
-                while j < n and depth:
-                    t2, d2, _p2 = table_events[j]
-                    if t2 == START and qname_localname(d2[0]) == "tr":
-                        depth += 1
-                    elif t2 == END and qname_localname(d2) == "tr":
-                        depth -= 1
-                    j += 1
+                j = find_block_end(table_events, i, "tr")
                 blocks.append(table_events[i:j])
                 i = j
                 continue
@@ -93,13 +77,15 @@ def extract_tr_blocks(table_events):
     return blocks
 
 
+def _cell_txt(c):
+    return collapse_ws(extract_text_from_events(c["events"]))
+
+
 def row_key(tr_events):
     """Key to align rows across table changes (based on first 2 cells' text)."""
     cells = extract_direct_tr_cells(tr_events)
     if not cells:
         return ("", "")
-    def _cell_txt(c):
-        return collapse_ws(extract_text_from_events(c["events"]))
     c0 = _cell_txt(cells[0]) if len(cells) > 0 else ""
     c1 = _cell_txt(cells[1]) if len(cells) > 1 else ""
     return (c0, c1)
@@ -120,20 +106,24 @@ def best_single_delete_index(oldk, newk):
     Choose which index to delete from old (len(old)=len(new)+1) to best
     preserve left-to-right alignment. Important when many cells are empty
     (empty keys are identical and would otherwise drift).
+
+    Los conteos de matches de prefijo/sufijo se precalculan con sumas
+    acumuladas, así cada candidato k se evalúa en O(1) en vez de recontar
+    sus rangos (O(n^2) en filas anchas).
     """
+    new_len = len(newk)
+    # pref[i]: matches oldk[j] == newk[j] para j < i.
+    pref = [0] * (new_len + 1)
+    for i0 in range(new_len):
+        pref[i0 + 1] = pref[i0] + (1 if oldk[i0] == newk[i0] else 0)
+    # suf[k]: matches oldk[j+1] == newk[j] para j >= k (old corrido una pos).
+    suf = [0] * (new_len + 1)
+    for i0 in range(new_len - 1, -1, -1):
+        suf[i0] = suf[i0 + 1] + (1 if oldk[i0 + 1] == newk[i0] else 0)
     best_k = 0
     best_score = -1
-    new_len = len(newk)
     for k in range(len(oldk)):
-        score = 0
-        # prefix
-        for i0 in range(min(k, new_len)):
-            if oldk[i0] == newk[i0]:
-                score += 1
-        # suffix: old[k+1:] aligns with new[k:]
-        for i0 in range(k, new_len):
-            if oldk[i0 + 1] == newk[i0]:
-                score += 1
+        score = pref[k if k < new_len else new_len] + (suf[k] if k <= new_len else 0)
         if score > best_score:
             best_score = score
             best_k = k
@@ -145,20 +135,21 @@ def best_single_insert_index(oldk, newk):
     Choose which index to insert into old (len(new)=len(old)+1) by selecting
     the index in new that best preserves alignment (i.e. delete that index
     from new yields best match).
+
+    Misma evaluación O(1) por candidato que best_single_delete_index.
     """
+    old_len = len(oldk)
+    pref = [0] * (old_len + 1)
+    for i0 in range(old_len):
+        pref[i0 + 1] = pref[i0] + (1 if oldk[i0] == newk[i0] else 0)
+    # suf[k]: matches oldk[j] == newk[j+1] para j >= k (new corrido una pos).
+    suf = [0] * (old_len + 1)
+    for i0 in range(old_len - 1, -1, -1):
+        suf[i0] = suf[i0 + 1] + (1 if oldk[i0] == newk[i0 + 1] else 0)
     best_k = 0
     best_score = -1
-    old_len = len(oldk)
     for k in range(len(newk)):
-        score = 0
-        # prefix
-        for i0 in range(min(k, old_len)):
-            if oldk[i0] == newk[i0]:
-                score += 1
-        # suffix: old[k:] aligns with new[k+1:]
-        for i0 in range(k, old_len):
-            if oldk[i0] == newk[i0 + 1]:
-                score += 1
+        score = pref[k if k < old_len else old_len] + (suf[k] if k <= old_len else 0)
         if score > best_score:
             best_score = score
             best_k = k
@@ -205,6 +196,189 @@ def _merge_inherited_style(del_style_val, table_old_style):
     return '; '.join(f'{k}: {v}' for k, v in del_props.items())
 
 
+def _align_key(cell):
+    # Memoizada en el dict de la celda: _diff_cell_pair vuelve a pedir
+    # la clave de cada lado y el texto extraído no es gratis.
+    key = cell.get('_align')
+    if key is None:
+        key = (
+            cell["tag"],
+            collapse_ws(extract_text_from_events(cell["events"])),
+        )
+        cell['_align'] = key
+    return key
+
+
+def _emit_block_as(differ, events, ctx):
+    """Emite un bloque como cambio propio: diff_group + contexto 'del'/'ins'
+    en un solo lugar. Cada bloque conserva su grupo (y su diff-id) separado;
+    agrupar varios bajo un mismo diff_group cambiaría la granularidad de los
+    cambios accionables."""
+    with differ.diff_group():
+        with differ.context(ctx):
+            differ.block_process(events)
+
+
+def _normalize_event(ev):
+    if ev[0] == START:
+        tag, attrs = ev[1]
+        norm_attrs = tuple(
+            (str(k), normalize_style_value(v) if str(k) == 'style' else v)
+            for k, v in sorted(attrs, key=lambda x: str(x[0]))
+        )
+        return (ev[0], (str(tag), norm_attrs))
+    return (ev[0], ev[1])
+
+
+def _diff_cell_pair(differ, old_cell, new_cell, table_old_style=None):
+    """Diff one old/new cell (td/th), preserving structure.
+    
+    When text differs, emit a SINGLE cell wrapper with inline del/ins
+    for the content, instead of two separate cells (which creates an extra column).
+    When only style changes, emit inline del(old style)/ins(new style).
+    """
+    old_events = old_cell['events']
+    new_events = new_cell['events']
+    
+    if not old_events or old_events[0][0] != START or old_events[-1][0] != END:
+        # Fallback
+        with differ.diff_group():
+            with differ.context('del'):
+                differ.block_process(old_events)
+            with differ.context('ins'):
+                differ.block_process(new_events)
+        return
+
+    old_attrs = old_events[0][1][1]
+    new_attrs = new_events[0][1][1] if new_events and new_events[0][0] == START else old_attrs
+    same_text = (_align_key(old_cell) == _align_key(new_cell))
+    same_attrs = _attrs_equal_normalized(old_attrs, new_attrs)
+    
+    if same_text and same_attrs:
+        if table_old_style:
+            # Table style changed (inherited via CSS) but cell attrs identical.
+            # Emit del(table old style)/ins so user sees old vs new font.
+            cell_tag = new_events[0][1][0]
+            cell_attrs = new_events[0][1][1]
+            diff_id = differ._new_diff_id() if differ._add_diff_ids else None
+            if diff_id:
+                cell_attrs = differ._set_attr(cell_attrs, differ._diff_id_attr, diff_id)
+            differ.append(START, (cell_tag, cell_attrs), new_events[0][2])
+
+            old_content = old_events[1:-1]
+            new_content = new_events[1:-1]
+
+            with differ.diff_group():
+                del_attrs = Attrs([(QName('style'), table_old_style)])
+                inner_id = differ._new_diff_id() if diff_id else None
+                if inner_id:
+                    del_attrs = del_attrs | [(differ._q_diff_id, inner_id)]
+                differ.append(START, (QName('del'), del_attrs), (None, -1, -1))
+                differ.extend_raw(old_content)
+                differ.append(END, QName('del'), (None, -1, -1))
+
+                ins_attrs = Attrs()
+                if inner_id:
+                    ins_attrs = ins_attrs | [(differ._q_diff_id, differ._new_diff_id())]
+                differ.append(START, (QName('ins'), ins_attrs), (None, -1, -1))
+                differ.extend_raw(new_content)
+                differ.append(END, QName('ins'), (None, -1, -1))
+
+            differ.append(*new_events[-1])
+            return
+        # Cell text and attrs are equal. However inner elements may have changed
+        # (e.g. a <span> style change). Check if events are semantically identical
+        # (normalize style order to avoid false positives).
+        old_norm = [_normalize_event(e) for e in old_events]
+        new_norm = [_normalize_event(e) for e in new_events]
+        if old_norm == new_norm:
+            # Truly identical after normalization: emit as-is
+            differ.extend_raw(new_events)
+            return
+        # Inner events differ (style change on child element): use EventDiffer
+        differ.extend_raw(differ._inner_diff_events(old_events, new_events))
+        return
+    
+    if same_text and not same_attrs:
+        # Style-only change: emit new cell wrapper (plain, no extra class),
+        # then inline del(old style) + ins(new content).
+        cell_tag = new_events[0][1][0]
+        cell_attrs = new_events[0][1][1]
+        diff_id = differ._new_diff_id() if differ._add_diff_ids else None
+        if diff_id:
+            cell_attrs = differ._set_attr(cell_attrs, differ._diff_id_attr, diff_id)
+        differ.append(START, (cell_tag, cell_attrs), new_events[0][2])
+        
+        old_content = old_events[1:-1]
+        new_content = new_events[1:-1]
+        
+        with differ.diff_group():
+            # Del with old style
+            old_style_val = old_attrs.get('style')
+            old_style_val = _merge_inherited_style(old_style_val, table_old_style)
+            del_attrs = Attrs()
+            if old_style_val:
+                del_attrs = del_attrs | [(QName('style'), old_style_val)]
+            inner_diff_id = differ._new_diff_id() if diff_id else None
+            if inner_diff_id:
+                del_attrs = del_attrs | [(differ._q_diff_id, inner_diff_id)]
+            differ.append(START, (QName('del'), del_attrs), (None, -1, -1))
+            differ.extend_raw(old_content)
+            differ.append(END, QName('del'), (None, -1, -1))
+            
+            # Ins inherits new style from cell wrapper
+            ins_attrs = Attrs()
+            if inner_diff_id:
+                ins_attrs = ins_attrs | [(differ._q_diff_id, differ._new_diff_id())]
+            differ.append(START, (QName('ins'), ins_attrs), (None, -1, -1))
+            differ.extend_raw(new_content)
+            differ.append(END, QName('ins'), (None, -1, -1))
+        
+        differ.append(*new_events[-1])
+        return
+    
+    # Text differs: emit SINGLE cell with inline del/ins content.
+    # Use new cell's wrapper (preserves new styles).
+    cell_start = new_events[0]
+    cell_end = new_events[-1]
+    old_content = old_events[1:-1]
+    new_content = new_events[1:-1] if len(new_events) > 2 else []
+    
+    # Emit new cell wrapper (plain, no extra class)
+    cell_tag = cell_start[1][0]
+    cell_attrs = cell_start[1][1]
+    differ.append(START, (cell_tag, cell_attrs), cell_start[2])
+    
+    with differ.diff_group():
+        if old_content:
+            # Del with old style if style changed
+            del_tag_attrs = Attrs()
+            if not same_attrs:
+                old_style_val = _merge_inherited_style(old_attrs.get('style'), table_old_style)
+                if old_style_val:
+                    del_tag_attrs = del_tag_attrs | [(QName('style'), old_style_val)]
+            elif table_old_style:
+                old_style_val = _merge_inherited_style(None, table_old_style)
+                if old_style_val:
+                    del_tag_attrs = del_tag_attrs | [(QName('style'), old_style_val)]
+            diff_id = differ._new_diff_id() if differ._add_diff_ids else None
+            if diff_id:
+                del_tag_attrs = del_tag_attrs | [(differ._q_diff_id, diff_id)]
+            differ.append(START, (QName('del'), del_tag_attrs), (None, -1, -1))
+            differ.extend_raw(old_content)
+            differ.append(END, QName('del'), (None, -1, -1))
+        if new_content:
+            ins_attrs = Attrs()
+            diff_id = differ._new_diff_id() if differ._add_diff_ids else None
+            if diff_id:
+                ins_attrs = ins_attrs | [(differ._q_diff_id, diff_id)]
+            differ.append(START, (QName('ins'), ins_attrs), (None, -1, -1))
+            differ.extend_raw(new_content)
+            differ.append(END, QName('ins'), (None, -1, -1))
+    
+    differ.append(*cell_end)
+
+
 def diff_tr_by_cells(differ, old_tr_events, new_tr_events, table_old_style=None):
     """
     Diff a table row by aligning direct child cells (<td>/<th>) with a row-aware
@@ -214,14 +388,9 @@ def diff_tr_by_cells(differ, old_tr_events, new_tr_events, table_old_style=None)
     when a column is removed/inserted, which otherwise causes the wrong cell/column
     to be marked as deleted and can break the table when changes are applied.
     """
-    # Import here to avoid circular import - _EventDiffer is created in differ.py
-    from .differ import _EventDiffer
-    
     # Defensive: if the slice doesn't look like a <tr> block, fall back.
     if not old_tr_events or not new_tr_events:
-        inner = _EventDiffer(old_tr_events, new_tr_events, differ.config, diff_id_state=differ._diff_id_state)
-        for ev in inner.get_diff_events():
-            differ.append(*ev)
+        differ.extend_raw(differ._inner_diff_events(old_tr_events, new_tr_events))
         return
 
     # Emit the <tr> wrapper (keep old wrapper; attributes rarely matter here).
@@ -234,232 +403,66 @@ def diff_tr_by_cells(differ, old_tr_events, new_tr_events, table_old_style=None)
     #   adds styling/attributes (border/padding) everywhere.
     # - full key (includes attrs/structure): used only when deciding whether we
     #   need to render a replace vs. let EventDiffer mark attribute diffs.
-    def _align_key(cell):
-        return (
-            cell["tag"],
-            collapse_ws(extract_text_from_events(cell["events"])),
-        )
 
     old_align = [_align_key(c) for c in old_cells]
     new_align = [_align_key(c) for c in new_cells]
-
-    def _diff_cell_pair(old_cell, new_cell):
-        """Diff one old/new cell (td/th), preserving structure.
-        
-        When text differs, emit a SINGLE cell wrapper with inline del/ins
-        for the content, instead of two separate cells (which creates an extra column).
-        When only style changes, emit inline del(old style)/ins(new style).
-        """
-        old_events = old_cell['events']
-        new_events = new_cell['events']
-        
-        if not old_events or old_events[0][0] != START or old_events[-1][0] != END:
-            # Fallback
-            with differ.diff_group():
-                with differ.context('del'):
-                    differ.block_process(old_events)
-                with differ.context('ins'):
-                    differ.block_process(new_events)
-            return
-
-        old_attrs = old_events[0][1][1]
-        new_attrs = new_events[0][1][1] if new_events and new_events[0][0] == START else old_attrs
-        same_text = (_align_key(old_cell) == _align_key(new_cell))
-        same_attrs = _attrs_equal_normalized(old_attrs, new_attrs)
-        
-        if same_text and same_attrs:
-            if table_old_style:
-                # Table style changed (inherited via CSS) but cell attrs identical.
-                # Emit del(table old style)/ins so user sees old vs new font.
-                cell_tag = new_events[0][1][0]
-                cell_attrs = new_events[0][1][1]
-                diff_id = differ._new_diff_id() if getattr(differ.config, 'add_diff_ids', False) else None
-                if diff_id:
-                    cell_attrs = differ._set_attr(cell_attrs, getattr(differ.config, 'diff_id_attr', 'data-diff-id'), diff_id)
-                differ.append(START, (cell_tag, cell_attrs), new_events[0][2])
-
-                old_content = old_events[1:-1]
-                new_content = new_events[1:-1]
-
-                with differ.diff_group():
-                    del_attrs = Attrs([(QName('style'), table_old_style)])
-                    inner_id = differ._new_diff_id() if diff_id else None
-                    if inner_id:
-                        del_attrs = del_attrs | [(QName(getattr(differ.config, 'diff_id_attr', 'data-diff-id')), inner_id)]
-                    differ.append(START, (QName('del'), del_attrs), (None, -1, -1))
-                    for ev in old_content:
-                        differ.append(*ev)
-                    differ.append(END, QName('del'), (None, -1, -1))
-
-                    ins_attrs = Attrs()
-                    if inner_id:
-                        ins_attrs = ins_attrs | [(QName(getattr(differ.config, 'diff_id_attr', 'data-diff-id')), differ._new_diff_id())]
-                    differ.append(START, (QName('ins'), ins_attrs), (None, -1, -1))
-                    for ev in new_content:
-                        differ.append(*ev)
-                    differ.append(END, QName('ins'), (None, -1, -1))
-
-                differ.append(*new_events[-1])
-                return
-            # Cell text and attrs are equal. However inner elements may have changed
-            # (e.g. a <span> style change). Check if events are semantically identical
-            # (normalize style order to avoid false positives).
-            def _normalize_event(ev):
-                if ev[0] == START:
-                    tag, attrs = ev[1]
-                    norm_attrs = tuple(
-                        (str(k), normalize_style_value(v) if str(k) == 'style' else v)
-                        for k, v in sorted(attrs, key=lambda x: str(x[0]))
-                    )
-                    return (ev[0], (str(tag), norm_attrs))
-                return (ev[0], ev[1])
-
-            old_norm = [_normalize_event(e) for e in old_events]
-            new_norm = [_normalize_event(e) for e in new_events]
-            if old_norm == new_norm:
-                # Truly identical after normalization: emit as-is
-                for ev in new_events:
-                    differ.append(*ev)
-                return
-            # Inner events differ (style change on child element): use EventDiffer
-            from .differ import _EventDiffer
-            inner = _EventDiffer(old_events, new_events, differ.config, diff_id_state=differ._diff_id_state)
-            for ev in inner.get_diff_events():
-                differ.append(*ev)
-            return
-        
-        if same_text and not same_attrs:
-            # Style-only change: emit new cell wrapper (plain, no extra class),
-            # then inline del(old style) + ins(new content).
-            cell_tag = new_events[0][1][0]
-            cell_attrs = new_events[0][1][1]
-            diff_id = differ._new_diff_id() if getattr(differ.config, 'add_diff_ids', False) else None
-            if diff_id:
-                cell_attrs = differ._set_attr(cell_attrs, getattr(differ.config, 'diff_id_attr', 'data-diff-id'), diff_id)
-            differ.append(START, (cell_tag, cell_attrs), new_events[0][2])
-            
-            old_content = old_events[1:-1]
-            new_content = new_events[1:-1]
-            
-            with differ.diff_group():
-                # Del with old style
-                old_style_val = old_attrs.get('style')
-                old_style_val = _merge_inherited_style(old_style_val, table_old_style)
-                del_attrs = Attrs()
-                if old_style_val:
-                    del_attrs = del_attrs | [(QName('style'), old_style_val)]
-                inner_diff_id = differ._new_diff_id() if diff_id else None
-                if inner_diff_id:
-                    del_attrs = del_attrs | [(QName(getattr(differ.config, 'diff_id_attr', 'data-diff-id')), inner_diff_id)]
-                differ.append(START, (QName('del'), del_attrs), (None, -1, -1))
-                for ev in old_content:
-                    differ.append(*ev)
-                differ.append(END, QName('del'), (None, -1, -1))
-                
-                # Ins inherits new style from cell wrapper
-                ins_attrs = Attrs()
-                if inner_diff_id:
-                    ins_attrs = ins_attrs | [(QName(getattr(differ.config, 'diff_id_attr', 'data-diff-id')), differ._new_diff_id())]
-                differ.append(START, (QName('ins'), ins_attrs), (None, -1, -1))
-                for ev in new_content:
-                    differ.append(*ev)
-                differ.append(END, QName('ins'), (None, -1, -1))
-            
-            differ.append(*new_events[-1])
-            return
-        
-        # Text differs: emit SINGLE cell with inline del/ins content.
-        # Use new cell's wrapper (preserves new styles).
-        cell_start = new_events[0]
-        cell_end = new_events[-1]
-        old_content = old_events[1:-1]
-        new_content = new_events[1:-1] if len(new_events) > 2 else []
-        
-        # Emit new cell wrapper (plain, no extra class)
-        cell_tag = cell_start[1][0]
-        cell_attrs = cell_start[1][1]
-        differ.append(START, (cell_tag, cell_attrs), cell_start[2])
-        
-        with differ.diff_group():
-            if old_content:
-                # Del with old style if style changed
-                del_tag_attrs = Attrs()
-                if not same_attrs:
-                    old_style_val = _merge_inherited_style(old_attrs.get('style'), table_old_style)
-                    if old_style_val:
-                        del_tag_attrs = del_tag_attrs | [(QName('style'), old_style_val)]
-                elif table_old_style:
-                    old_style_val = _merge_inherited_style(None, table_old_style)
-                    if old_style_val:
-                        del_tag_attrs = del_tag_attrs | [(QName('style'), old_style_val)]
-                diff_id = differ._new_diff_id() if getattr(differ.config, 'add_diff_ids', False) else None
-                if diff_id:
-                    del_tag_attrs = del_tag_attrs | [(QName(getattr(differ.config, 'diff_id_attr', 'data-diff-id')), diff_id)]
-                differ.append(START, (QName('del'), del_tag_attrs), (None, -1, -1))
-                for ev in old_content:
-                    differ.append(*ev)
-                differ.append(END, QName('del'), (None, -1, -1))
-            if new_content:
-                ins_attrs = Attrs()
-                diff_id = differ._new_diff_id() if getattr(differ.config, 'add_diff_ids', False) else None
-                if diff_id:
-                    ins_attrs = ins_attrs | [(QName(getattr(differ.config, 'diff_id_attr', 'data-diff-id')), diff_id)]
-                differ.append(START, (QName('ins'), ins_attrs), (None, -1, -1))
-                for ev in new_content:
-                    differ.append(*ev)
-                differ.append(END, QName('ins'), (None, -1, -1))
-        
-        differ.append(*cell_end)
+    # IDs enteros para los scorers y el bucle de alineación: comparar ints
+    # en vez de tuplas de strings en cada candidato.
+    align_pool = {}
+    align_enc = align_pool.setdefault
+    old_align_ids = [align_enc(k, len(align_pool)) for k in old_align]
+    new_align_ids = [align_enc(k, len(align_pool)) for k in new_align]
+
+    # Fast path: claves de alineación idénticas (caso común cuando el LLM
+    # solo reestiliza). El bucle general haría exactamente estos pares, así
+    # que se salta la heurística de columnas y la máquina de estados.
+    if old_align_ids == new_align_ids:
+        for o_cell, n_cell in zip(old_cells, new_cells):
+            _diff_cell_pair(differ, o_cell, n_cell, table_old_style)
+        differ.append(*old_tr_events[-1])
+        return
 
     # Special-case: single-column removal/addition. Do a positional alignment
     # with a stable chosen index, instead of key-based matching that can drift
     # across identical empty cells.
     if len(old_cells) == len(new_cells) + 1:
-        k = best_single_delete_index(old_align, new_align)
+        k = best_single_delete_index(old_align_ids, new_align_ids)
         # diff cells before k
         for idx in range(k):
             if idx < len(new_cells):
-                _diff_cell_pair(old_cells[idx], new_cells[idx])
+                _diff_cell_pair(differ, old_cells[idx], new_cells[idx], table_old_style)
             else:
-                with differ.diff_group():
-                    with differ.context('del'):
-                        differ.block_process(old_cells[idx]['events'])
+                _emit_block_as(differ, old_cells[idx]['events'], 'del')
         # delete the removed column cell
-        with differ.diff_group():
-            with differ.context('del'):
-                differ.block_process(old_cells[k]['events'])
+        _emit_block_as(differ, old_cells[k]['events'], 'del')
         # diff remaining cells after k (shifted left by one)
         for idx in range(k, len(new_cells)):
-            _diff_cell_pair(old_cells[idx + 1], new_cells[idx])
+            _diff_cell_pair(differ, old_cells[idx + 1], new_cells[idx], table_old_style)
         differ.append(*old_tr_events[-1])
         return
 
     if len(new_cells) == len(old_cells) + 1:
-        k = best_single_insert_index(old_align, new_align)
+        k = best_single_insert_index(old_align_ids, new_align_ids)
         # diff cells before k
         for idx in range(k):
             if idx < len(old_cells):
-                _diff_cell_pair(old_cells[idx], new_cells[idx])
+                _diff_cell_pair(differ, old_cells[idx], new_cells[idx], table_old_style)
             else:
-                with differ.diff_group():
-                    with differ.context('ins'):
-                        differ.block_process(new_cells[idx]['events'])
+                _emit_block_as(differ, new_cells[idx]['events'], 'ins')
         # insert the added column cell
-        with differ.diff_group():
-            with differ.context('ins'):
-                differ.block_process(new_cells[k]['events'])
+        _emit_block_as(differ, new_cells[k]['events'], 'ins')
         # diff remaining cells after k (shifted right by one in new)
         for idx in range(k, len(old_cells)):
-            _diff_cell_pair(old_cells[idx], new_cells[idx + 1])
+            _diff_cell_pair(differ, old_cells[idx], new_cells[idx + 1], table_old_style)
         differ.append(*old_tr_events[-1])
         return
 
     i = 0
     j = 0
     while i < len(old_cells) or j < len(new_cells):
-        if i < len(old_cells) and j < len(new_cells) and old_align[i] == new_align[j]:
+        if i < len(old_cells) and j < len(new_cells) and old_align_ids[i] == new_align_ids[j]:
             # Same cell -> diff through _diff_cell_pair which normalizes styles.
-            _diff_cell_pair(old_cells[i], new_cells[j])
+            _diff_cell_pair(differ, old_cells[i], new_cells[j], table_old_style)
             i += 1
             j += 1
             continue
@@ -469,38 +472,30 @@ def diff_tr_by_cells(differ, old_tr_events, new_tr_events, table_old_style=None)
 
         if i < len(old_cells) and old_remaining > new_remaining:
             # Prefer deleting from old when old has extra cells (common: column removal).
-            with differ.diff_group():
-                with differ.context('del'):
-                    differ.block_process(old_cells[i]['events'])
+            _emit_block_as(differ, old_cells[i]['events'], 'del')
             i += 1
             continue
 
         if j < len(new_cells) and new_remaining > old_remaining:
             # Prefer inserting when new has extra cells (column insertion).
-            with differ.diff_group():
-                with differ.context('ins'):
-                    differ.block_process(new_cells[j]['events'])
+            _emit_block_as(differ, new_cells[j]['events'], 'ins')
             j += 1
             continue
 
         # Same remaining length but different keys => treat as replace (paired).
         # Use _diff_cell_pair to emit SINGLE cell with inline del/ins.
         if i < len(old_cells) and j < len(new_cells):
-            _diff_cell_pair(old_cells[i], new_cells[j])
+            _diff_cell_pair(differ, old_cells[i], new_cells[j], table_old_style)
             i += 1
             j += 1
             continue
 
         # Fallback: emit unmatched cells
         if i < len(old_cells):
-            with differ.diff_group():
-                with differ.context('del'):
-                    differ.block_process(old_cells[i]['events'])
+            _emit_block_as(differ, old_cells[i]['events'], 'del')
             i += 1
         if j < len(new_cells):
-            with differ.diff_group():
-                with differ.context('ins'):
-                    differ.block_process(new_cells[j]['events'])
+            _emit_block_as(differ, new_cells[j]['events'], 'ins')
             j += 1
 
     differ.append(*old_tr_events[-1])
@@ -514,13 +509,8 @@ def diff_table_by_rows(differ, old_table_events, new_table_events):
     attributes, and ensures column removals are handled by our row-aware
     `diff_tr_by_cells` logic.
     """
-    # Import here to avoid circular import - _EventDiffer is created in differ.py
-    from .differ import _EventDiffer
-    
     if not old_table_events or not new_table_events:
-        inner = _EventDiffer(old_table_events, new_table_events, differ.config, diff_id_state=differ._diff_id_state)
-        for ev in inner.get_diff_events():
-            differ.append(*ev)
+        differ.extend_raw(differ._inner_diff_events(old_table_events, new_table_events))
         return
 
     # Check whether the table wrapper attrs changed (style, etc.)
@@ -541,21 +531,18 @@ def diff_table_by_rows(differ, old_table_events, new_table_events):
         # Hidden structural revert data
         del_attrs = Attrs([(QName('class'), 'structural-revert-data'),
                            (QName('style'), 'display:none')])
-        diff_id = differ._new_diff_id() if getattr(differ.config, 'add_diff_ids', False) else None
+        diff_id = differ._new_diff_id() if differ._add_diff_ids else None
         if diff_id:
-            del_attrs = del_attrs | [(QName(getattr(differ.config, 'diff_id_attr', 'data-diff-id')), diff_id)]
+            del_attrs = del_attrs | [(differ._q_diff_id, diff_id)]
         differ.append(START, (QName('del'), del_attrs), (None, -1, -1))
-        for ev in old_table_events:
-            differ.append(*ev)
+        differ.extend_raw(old_table_events)
         differ.append(END, QName('del'), (None, -1, -1))
 
         # Emit new table wrapper with tagdiff_added + data-old-*
         new_tag = new_table_start[1][0]
         new_attrs_out = new_table_start[1][1]
-        new_attrs_out = differ.inject_class(new_attrs_out, 'tagdiff_added')
-        new_attrs_out = differ.inject_refattr(new_attrs_out, old_attrs)
-        if diff_id:
-            new_attrs_out = differ._set_attr(new_attrs_out, getattr(differ.config, 'diff_id_attr', 'data-diff-id'), diff_id)
+        new_attrs_out = differ._build_replaced_attrs(new_attrs_out, old_attrs, 'tagdiff_added',
+                                                     diff_id=diff_id)
         differ.append(START, (new_tag, new_attrs_out), new_table_start[2])
     elif old_table_start[0] == START:
         differ.append(*new_table_events[0])
@@ -566,9 +553,26 @@ def diff_table_by_rows(differ, old_table_events, new_table_events):
     new_rows = extract_tr_blocks(new_table_events)
     old_keys = [row_key(r) for r in old_rows]
     new_keys = [row_key(r) for r in new_rows]
+    # Internar claves a enteros abarata el hash/eq repetido del matcher
+    # (las claves de fila son tuplas de strings), igual que en _EventDiffer.
+    key_to_id = {}
+    enc = key_to_id.setdefault
+    old_ids = [enc(k, len(key_to_id)) for k in old_keys]
+    new_ids = [enc(k, len(key_to_id)) for k in new_keys]
+
+    # Fast path: mismas claves de fila en el mismo orden — el matcher solo
+    # devolvería un 'equal' gigante, así que se emparejan las filas directo.
+    if old_ids == new_ids:
+        for o_row, n_row in zip(old_rows, new_rows):
+            diff_tr_by_cells(differ, o_row, n_row,
+                             table_old_style=old_table_style if table_attrs_changed else None)
+        differ.append(*new_table_events[-1])
+        return
 
-    matcher = SequenceMatcher(None, old_keys, new_keys)
-    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+    # compute_opcodes escala mejor que SequenceMatcher puro en tablas con
+    # cientos de filas: usa el Myers acotado de utils cuando el total de
+    # filas supera el umbral y SequenceMatcher para tablas chicas.
+    for tag, i1, i2, j1, j2 in compute_opcodes(old_ids, new_ids):
         if tag == "equal":
             for oi, nj in zip(range(i1, i2), range(j1, j2)):
                 diff_tr_by_cells(differ, old_rows[oi], new_rows[nj],
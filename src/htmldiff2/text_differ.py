@@ -9,14 +9,61 @@ from __future__ import with_statement
 
 import re
 from difflib import SequenceMatcher
-from itertools import chain
+from functools import lru_cache
+from itertools import accumulate
 from genshi.core import QName, START, END, TEXT
 
-from .config import _leading_space_re, _diff_split_re, _token_split_re
-from .utils import qname_localname
+from .config import _leading_space_re, _token_split_re
+from .utils import qname_localname, compute_opcodes, BisectSequenceMatcher
 
+# QNames de marcado construidos una sola vez: QName() parsea el string en
+# cada construcción y mark_text corre por cada tramo ins/del emitido.
+_Q_INS = QName('ins')
+_Q_DEL = QName('del')
 
-class InsensitiveSequenceMatcher(SequenceMatcher):
+# Equivalente en una pasada del idioma chain+next del branch legacy de
+# text_split: palabra con su whitespace precedente pegado, más el whitespace
+# final como token propio (verificado por fuzzing contra el idioma original).
+_LEGACY_SPLIT_RE = re.compile(r'\s*\S+|\s+\Z', re.U)
+
+# Patrón precompilado para _make_ws_visible: mark_text corre por cada
+# token ins/del emitido, así que no conviene recompilar por llamada.
+_RUN_WS_RE = re.compile(r' {2,}')
+
+# Corridas de NBSP precalculadas: evita construir u'\u00a0' * n por match
+# (las corridas reales de whitespace casi nunca superan unas pocas posiciones).
+_NBSP_RUNS = [u'\u00a0' * i for i in range(33)]
+
+
+def _nbsp_run(match):
+    n = match.end() - match.start()
+    return _NBSP_RUNS[n] if n < 33 else u'\u00a0' * n
+
+
+def _make_ws_visible(s):
+    # Convert whitespace that would otherwise be collapsed by HTML into NBSPs,
+    # but keep single mid-string spaces intact for readability.
+    if not s:
+        return s
+    # Caso común: sin whitespace en los bordes ni corridas de espacios,
+    # no hay nada que sustituir — un find C-level evita las pasadas del
+    # motor de re por token.
+    if not s[0].isspace() and not s[-1].isspace() and s.find('  ') < 0:
+        return s
+    # Leading / trailing spaces: always NBSP. lstrip/rstrip + slice en vez
+    # de regex: el largo de la corrida sale de la diferencia de longitudes.
+    left = len(s) - len(s.lstrip())
+    if left:
+        s = (_NBSP_RUNS[left] if left < 33 else u'\u00a0' * left) + s[left:]
+    right = len(s) - len(s.rstrip())
+    if right:
+        s = s[:len(s) - right] + (_NBSP_RUNS[right] if right < 33 else u'\u00a0' * right)
+    # Runs of 2+ spaces inside: NBSP for the run
+    s = _RUN_WS_RE.sub(_nbsp_run, s)
+    return s
+
+
+class InsensitiveSequenceMatcher(BisectSequenceMatcher):
     """
     SequenceMatcher that ignores very small matching blocks.
     
@@ -36,8 +83,28 @@ class InsensitiveSequenceMatcher(SequenceMatcher):
         
         blocks = super().get_matching_blocks()
         # Keep blocks larger than threshold, or the sentinel (size=0) at the end.
-        return [block for block in blocks 
-                if block[2] > effective_threshold or block[2] == 0]
+        # Filtrado in place con índice de escritura: sin lista nueva por
+        # llamada. Es idempotente, así que reusar la lista que difflib cachea
+        # en self.matching_blocks no altera llamadas repetidas.
+        w = 0
+        for block in blocks:
+            if block[2] > effective_threshold or block[2] == 0:
+                blocks[w] = block
+                w += 1
+        del blocks[w:]
+        return blocks
+
+
+@lru_cache(maxsize=4096)
+def split_tokens_cached(rx, text):
+    """Tokeniza con el regex dado, memoizando por (patrón, texto).
+
+    Las mismas frases aparecen muchas veces en un diff (etiquetas de celdas,
+    encabezados, y sobre todo el mismo texto en el documento viejo y el
+    nuevo); un hit devuelve la tupla ya calculada sin pasar por re.split.
+    Devuelve tupla (inmutable) para que la caché sea segura de compartir.
+    """
+    return tuple(p for p in rx.split(text) if p != u'')
 
 
 def text_split(differ, text):
@@ -50,11 +117,14 @@ def text_split(differ, text):
     """
     if getattr(differ.config, 'tokenize_text', True):
         rx = getattr(differ.config, 'tokenize_regex', _token_split_re)
-        parts = [p for p in rx.split(text) if p != u'']
-        return parts
-    # Legacy behavior: keep words glued to following whitespace
-    worditer = chain([u''], _diff_split_re.split(text))
-    return [x + next(worditer) for x in worditer]
+        return split_tokens_cached(rx, text)
+    # Legacy behavior: keep words glued to their surrounding whitespace.
+    # Un findall C-level reemplaza el zip manual sobre el split capturado;
+    # el token vacío inicial se conserva cuando el texto arranca en espacio.
+    tokens = _LEGACY_SPLIT_RE.findall(text)
+    if not text or text[0].isspace():
+        tokens.insert(0, u'')
+    return tokens
 
 
 def cut_leading_space(s):
@@ -76,35 +146,29 @@ def mark_text(differ, pos, text, tag, diff_id=None):
         tag: Tag name ('ins' or 'del')
         diff_id: Optional diff ID for grouping
     """
-    def _make_ws_visible(s):
-        # Convert whitespace that would otherwise be collapsed by HTML into NBSPs,
-        # but keep single mid-string spaces intact for readability.
-        if not s:
-            return s
-        # Leading / trailing spaces: always NBSP
-        s = re.sub(r'^\s+', lambda m: u'\u00a0' * len(m.group(0)), s, flags=re.U)
-        s = re.sub(r'\s+$', lambda m: u'\u00a0' * len(m.group(0)), s, flags=re.U)
-        # Runs of 2+ spaces inside: NBSP for the run
-        s = re.sub(r' {2,}', lambda m: u'\u00a0' * len(m.group(0)), s)
-        return s
-
-    tag_qname = QName(tag)
-    preserve_ws = getattr(differ.config, 'preserve_whitespace_in_diff', True) and qname_localname(tag_qname) in ('del', 'ins')
+    tag_qname = _Q_DEL if tag == 'del' else _Q_INS if tag == 'ins' else QName(tag)
+    is_marker = tag == 'del' or tag == 'ins'
+    preserve_ws = differ._preserve_ws and is_marker
+    # Emisión en bloque: un extend_raw por marca en lugar de 3-4 appends que
+    # repiten el chequeo de buffer y de marcador evento por evento.
+    if is_marker:
+        differ._emitted_change_markers = True
     if preserve_ws:
         text = _make_ws_visible(text)
         attrs = differ._change_attrs(diff_id=diff_id)
-        differ.append(START, (tag_qname, attrs), pos)
-        differ.append(TEXT, text, pos)
-        differ.append(END, tag_qname, pos)
+        differ.extend_raw([(START, (tag_qname, attrs), pos),
+                           (TEXT, text, pos),
+                           (END, tag_qname, pos)])
         return
 
     ws, text = cut_leading_space(text)
-    if ws:
-        differ.append(TEXT, ws, pos)
     attrs = differ._change_attrs(diff_id=diff_id)
-    differ.append(START, (tag_qname, attrs), pos)
-    differ.append(TEXT, text, pos)
-    differ.append(END, tag_qname, pos)
+    events = [(START, (tag_qname, attrs), pos),
+              (TEXT, text, pos),
+              (END, tag_qname, pos)]
+    if ws:
+        events.insert(0, (TEXT, ws, pos))
+    differ.extend_raw(events)
 
 
 def diff_text(differ, pos, old_text, new_text):
@@ -119,8 +183,25 @@ def diff_text(differ, pos, old_text, new_text):
     """
     old = text_split(differ, old_text)
     new = text_split(differ, new_text)
-    threshold = getattr(differ.config, 'sequence_match_threshold', 2)
-    matcher = InsensitiveSequenceMatcher(None, old, new, threshold=threshold)
+    long_threshold = getattr(differ.config, 'long_text_threshold', 2000)
+    if min(len(old), len(new)) > long_threshold:
+        # Textos muy largos: el matcher con filtro de bloques chicos tiene
+        # peor caso cuadrático sobre texto repetitivo. compute_opcodes usa el
+        # Myers acotado de utils; se pierde el filtrado anti-"triturado",
+        # que en textos de este tamaño aporta poco.
+        opcodes = compute_opcodes(old, new)
+    else:
+        threshold = getattr(differ.config, 'sequence_match_threshold', 2)
+        matcher = InsensitiveSequenceMatcher(None, old, new, threshold=threshold)
+        opcodes = matcher.get_opcodes()
+
+    # Texto pre-unido + offsets acumulados: cada u''.join(old[i1:i2]) del
+    # bucle de opcodes se vuelve un slice de string (una sola copia C-level)
+    # en vez de slice de lista + join por opcode.
+    old_cat = u''.join(old)
+    new_cat = u''.join(new)
+    old_off = list(accumulate((len(w) for w in old), initial=0))
+    new_off = list(accumulate((len(w) for w in new), initial=0))
 
     def wrap(tag, words, diff_id=None):
         return mark_text(differ, pos, u''.join(words), tag, diff_id=diff_id)
@@ -132,25 +213,22 @@ def diff_text(differ, pos, old_text, new_text):
     pending_ins = []
 
     def flush_pending():
-        if pending_del and pending_ins:
-            # Pair del+ins under the same diff-id for per-change frontend actions.
-            diff_id = differ._new_diff_id() if getattr(differ.config, 'add_diff_ids', False) else None
-            wrap('del', pending_del, diff_id=diff_id)
-            del pending_del[:]
-            wrap('ins', pending_ins, diff_id=diff_id)
-            del pending_ins[:]
+        if not pending_del and not pending_ins:
             return
+        # Pair del+ins under the same diff-id for per-change frontend actions;
+        # un solo cálculo del id cubre los tres casos (del, ins, o ambos).
+        diff_id = differ._new_diff_id() if differ._add_diff_ids else None
         if pending_del:
-            wrap('del', pending_del, diff_id=(differ._new_diff_id() if getattr(differ.config, 'add_diff_ids', False) else None))
+            wrap('del', pending_del, diff_id=diff_id)
             del pending_del[:]
         if pending_ins:
-            wrap('ins', pending_ins, diff_id=(differ._new_diff_id() if getattr(differ.config, 'add_diff_ids', False) else None))
+            wrap('ins', pending_ins, diff_id=diff_id)
             del pending_ins[:]
 
-    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+    for tag, i1, i2, j1, j2 in opcodes:
         if tag == 'equal':
             flush_pending()
-            differ.append(TEXT, u''.join(old[i1:i2]), pos)
+            differ.append(TEXT, old_cat[old_off[i1]:old_off[i2]], pos)
             continue
         if tag == 'replace':
             # Special-case: whitespace-only "replace" where the only change is the
@@ -158,8 +236,8 @@ def diff_text(differ, pos, old_text, new_text):
             # to emit this as replace, which renders as del+ins. For EdenAI we
             # prefer a minimal representation: keep the common whitespace
             # unchanged, and only mark the extra spaces as deleted/inserted.
-            old_part = u''.join(old[i1:i2])
-            new_part = u''.join(new[j1:j2])
+            old_part = old_cat[old_off[i1]:old_off[i2]]
+            new_part = new_cat[new_off[j1]:new_off[j2]]
             if (
                 old_part
                 and new_part
@@ -182,12 +260,12 @@ def diff_text(differ, pos, old_text, new_text):
                 if new_rem:
                     pending_ins.append(new_rem)
                 continue
-            pending_del.extend(old[i1:i2])
-            pending_ins.extend(new[j1:j2])
+            pending_del.append(old_part)
+            pending_ins.append(new_part)
         elif tag == 'delete':
-            pending_del.extend(old[i1:i2])
+            pending_del.append(old_cat[old_off[i1]:old_off[i2]])
         elif tag == 'insert':
-            pending_ins.extend(new[j1:j2])
+            pending_ins.append(new_cat[new_off[j1]:new_off[j2]])
         else:
             pass
     flush_pending()
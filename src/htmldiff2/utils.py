@@ -2,15 +2,36 @@
 """
 Funciones utilitarias para htmldiff2.
 """
+import re
+from bisect import bisect_left
+from difflib import SequenceMatcher, Match
+from functools import lru_cache
+
 from .config import text_type, INLINE_FORMATTING_TAGS, STRUCTURAL_TAGS
 from genshi.core import TEXT, START, END
 
+_WS_RE = re.compile(r'\s+', re.U)
+
+# Umbral de despacho para compute_opcodes: por debajo, SequenceMatcher;
+# por encima, Myers. Cota de distancia de edición para acotar la memoria
+# del backtrace de Myers (O(D²) en el peor caso).
+_MYERS_MIN_TOTAL = 400
+_MYERS_MAX_D = 1024
+# Largo mínimo para habilitar autojunk en el fallback a SequenceMatcher
+# (muy por encima del umbral de 200 de difflib, para no descartar átomos
+# comunes pero significativos en documentos medianos).
+_AUTOJUNK_MIN_LEN = 2000
 
+
+@lru_cache(maxsize=1024)
 def qname_localname(qname):
     """
     QName in genshi renders like 'tag' or '{ns}tag'. Normalize to localname.
     Always coerce to text; QName can behave like a string in some environments,
     but we want a real text value (not a QName instance) to keep comparisons stable.
+
+    Cacheado: el repertorio de QNames de un documento es chico y esta función
+    se llama por evento en varios filtros.
     """
     s = text_type(qname)
     if '}' in s:
@@ -21,10 +42,15 @@ def qname_localname(qname):
     return s
 
 
+@lru_cache(maxsize=4096)
 def collapse_ws(s):
-    """Colapsa espacios en blanco múltiples en un solo espacio."""
-    import re
-    return re.sub(r'\s+', ' ', s, flags=re.U).strip()
+    """Colapsa espacios en blanco múltiples en un solo espacio.
+
+    Cacheado: las comparaciones de texto colapsado (claves de átomos,
+    toggles de wrappers visuales, celdas de tabla) pasan los mismos strings
+    muchas veces, y el documento viejo y el nuevo comparten casi todo.
+    """
+    return _WS_RE.sub(' ', s).strip()
 
 
 def strip_edge_whitespace_events(events):
@@ -72,30 +98,246 @@ def raw_text_from_events(events):
     return u''.join(parts)
 
 
-def concat_events(atoms):
-    """Concatena eventos de múltiples átomos."""
+def concat_events(atoms, lo=0, hi=None):
+    """Concatena eventos de los átomos en el rango [lo:hi).
+
+    Acepta índices para que los llamadores no tengan que materializar un
+    slice de la lista de átomos solo para concatenar sus eventos.
+    """
+    if hi is None:
+        hi = len(atoms)
+    if hi - lo == 1:
+        # Común en los opcodes de un solo átomo; evita copiar la lista.
+        return atoms[lo]['events']
     rv = []
-    for a in atoms:
-        rv.extend(a['events'])
+    for x in range(lo, hi):
+        rv.extend(atoms[x]['events'])
     return rv
 
 
 def longest_common_prefix_len(a, b):
-    """Calcula la longitud del prefijo común más largo."""
+    """Calcula la longitud del prefijo común más largo.
+
+    Usa comparación de slices (memcmp en C) con búsqueda binaria en vez de un
+    bucle carácter a carácter en Python: O(n log n) a velocidad C gana por
+    mucho al bucle O(n) interpretado en textos largos.
+    """
     n = min(len(a), len(b))
-    i = 0
-    while i < n and a[i] == b[i]:
-        i += 1
-    return i
+    if n == 0 or a[0] != b[0]:
+        return 0
+    if a[:n] == b[:n]:
+        return n
+    lo, hi = 1, n - 1
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        if a[:mid] == b[:mid]:
+            lo = mid
+        else:
+            hi = mid - 1
+    return lo
 
 
 def longest_common_suffix_len(a, b, max_prefix=0):
-    """Calcula la longitud del sufijo común más largo evitando solapamiento con el prefijo."""
+    """Calcula la longitud del sufijo común más largo evitando solapamiento con el prefijo.
+
+    Misma técnica de slices + bisección que longest_common_prefix_len.
+    """
     max_len = min(len(a) - max_prefix, len(b) - max_prefix)
-    i = 0
-    while i < max_len and a[-1 - i] == b[-1 - i]:
-        i += 1
-    return i
+    if max_len <= 0 or a[-1] != b[-1]:
+        return 0
+    if a[len(a) - max_len:] == b[len(b) - max_len:]:
+        return max_len
+    lo, hi = 1, max_len - 1
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        if a[len(a) - mid:] == b[len(b) - mid:]:
+            lo = mid
+        else:
+            hi = mid - 1
+    return lo
+
+
+def compute_opcodes(a, b):
+    """
+    Opcodes estilo difflib (tag, i1, i2, j1, j2) para dos secuencias.
+
+    Secuencias cortas usan SequenceMatcher con autojunk=False (la heurística
+    de autojunk descarta elementos "populares" y produce pares delete+insert
+    espurios). Para secuencias largas con pocas ediciones, Myers corre en
+    O((N+M)·D) — casi lineal — frente al peor caso cuadrático de
+    SequenceMatcher; si la distancia de edición excede _MYERS_MAX_D se vuelve
+    a SequenceMatcher para no dejar crecer el backtrace.
+    """
+    if len(a) + len(b) < _MYERS_MIN_TOTAL:
+        return SequenceMatcher(None, a, b, autojunk=False).get_opcodes()
+    opcodes = _myers_opcodes(a, b)
+    if opcodes is None:
+        # Fallback para documentos grandes y muy distintos (D > _MYERS_MAX_D):
+        # acá sí conviene autojunk en secuencias realmente largas — el descarte
+        # de elementos populares acota el cuadrático y el resultado termina
+        # igualmente en un replace masivo.
+        aj = max(len(a), len(b)) >= _AUTOJUNK_MIN_LEN
+        return SequenceMatcher(None, a, b, autojunk=aj).get_opcodes()
+    return opcodes
+
+
+def _myers_opcodes(a, b):
+    """
+    Diff greedy de Myers con backtrace. Devuelve opcodes compatibles con
+    difflib (delete+insert adyacentes se funden en un replace), o None si la
+    distancia de edición supera _MYERS_MAX_D.
+    """
+    n, m = len(a), len(b)
+    v = {1: 0}
+    trace = []
+    found_d = -1
+    for d in range(min(n + m, _MYERS_MAX_D) + 1):
+        trace.append(dict(v))
+        for k in range(-d, d + 1, 2):
+            if k == -d or (k != d and v[k - 1] < v[k + 1]):
+                x = v[k + 1]
+            else:
+                x = v[k - 1] + 1
+            y = x - k
+            while x < n and y < m and a[x] == b[y]:
+                x += 1
+                y += 1
+            v[k] = x
+            if x >= n and y >= m:
+                found_d = d
+                break
+        if found_d >= 0:
+            break
+    if found_d < 0:
+        return None
+
+    # Backtrace: reconstruye los pasos del final hacia el inicio.
+    steps = []  # 'e' (igual) / 'd' (delete) / 'i' (insert), en orden inverso
+    x, y = n, m
+    for d in range(found_d, -1, -1):
+        if d == 0:
+            prev_x = prev_y = 0
+        else:
+            v = trace[d]
+            k = x - y
+            if k == -d or (k != d and v[k - 1] < v[k + 1]):
+                prev_k = k + 1
+            else:
+                prev_k = k - 1
+            prev_x = v[prev_k]
+            prev_y = prev_x - prev_k
+        while x > prev_x and y > prev_y:
+            steps.append('e')
+            x -= 1
+            y -= 1
+        if d > 0:
+            if x == prev_x + 1 and y == prev_y:
+                steps.append('d')
+                x -= 1
+            else:
+                steps.append('i')
+                y -= 1
+
+    steps.reverse()
+    opcodes = []
+    i = j = 0
+    idx = 0
+    total = len(steps)
+    while idx < total:
+        if steps[idx] == 'e':
+            run = idx
+            while run < total and steps[run] == 'e':
+                run += 1
+            cnt = run - idx
+            opcodes.append(('equal', i, i + cnt, j, j + cnt))
+            i += cnt
+            j += cnt
+            idx = run
+        else:
+            nd = ni = 0
+            run = idx
+            while run < total and steps[run] != 'e':
+                if steps[run] == 'd':
+                    nd += 1
+                else:
+                    ni += 1
+                run += 1
+            if nd and ni:
+                opcodes.append(('replace', i, i + nd, j, j + ni))
+            elif nd:
+                opcodes.append(('delete', i, i + nd, j, j))
+            else:
+                opcodes.append(('insert', i, i, j, j + ni))
+            i += nd
+            j += ni
+            idx = run
+    return opcodes
+
+
+class BisectSequenceMatcher(SequenceMatcher):
+    """
+    SequenceMatcher cuyo find_longest_match recorta las listas de posiciones
+    de b2j con bisect en lugar de saltar con `if j < blo / j >= bhi` elemento
+    por elemento. En llamadas recursivas sobre ventanas chicas de textos
+    largos con tokens repetidos, evita recorrer posiciones fuera de rango.
+    El resto del comportamiento (junk, popular, extensión del match) es el
+    de la stdlib.
+    """
+
+    def find_longest_match(self, alo=0, ahi=None, blo=0, bhi=None):
+        a, b, b2j, isbjunk = self.a, self.b, self.b2j, self.bjunk.__contains__
+        if ahi is None:
+            ahi = len(a)
+        if bhi is None:
+            bhi = len(b)
+        besti, bestj, bestsize = alo, blo, 0
+        j2len = {}
+        nothing = []
+        windowed = blo > 0 or bhi < len(b)
+        # Las posiciones ya recortadas a [blo, bhi) se memoizan por token
+        # dentro de esta llamada: los tokens repetidos (palabras frecuentes,
+        # celdas duplicadas) no vuelven a pagar el bisect + slice.
+        window_cache = {}
+        wc_get = window_cache.get
+        for i in range(alo, ahi):
+            j2lenget = j2len.get
+            newj2len = {}
+            ai = a[i]
+            js = wc_get(ai)
+            if js is None:
+                js = b2j.get(ai, nothing)
+                if js and windowed:
+                    lo = bisect_left(js, blo)
+                    hi = bisect_left(js, bhi, lo)
+                    js = js[lo:hi]
+                window_cache[ai] = js
+            for j in js:
+                k = j2lenget(j - 1, 0) + 1
+                newj2len[j] = k
+                if k > bestsize:
+                    besti, bestj, bestsize = i - k + 1, j - k + 1, k
+            j2len = newj2len
+
+        # Extensión del match con elementos junk/no-junk, igual que la stdlib.
+        while besti > alo and bestj > blo and \
+              not isbjunk(b[bestj - 1]) and \
+              a[besti - 1] == b[bestj - 1]:
+            besti, bestj, bestsize = besti - 1, bestj - 1, bestsize + 1
+        while besti + bestsize < ahi and bestj + bestsize < bhi and \
+              not isbjunk(b[bestj + bestsize]) and \
+              a[besti + bestsize] == b[bestj + bestsize]:
+            bestsize += 1
+
+        while besti > alo and bestj > blo and \
+              isbjunk(b[bestj - 1]) and \
+              a[besti - 1] == b[bestj - 1]:
+            besti, bestj, bestsize = besti - 1, bestj - 1, bestsize + 1
+        while besti + bestsize < ahi and bestj + bestsize < bhi and \
+              isbjunk(b[bestj + bestsize]) and \
+              a[besti + bestsize] == b[bestj + bestsize]:
+            bestsize += 1
+
+        return Match(besti, bestj, bestsize)
 
 
 def has_visual_attrs(attrs, config):
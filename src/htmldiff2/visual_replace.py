@@ -7,6 +7,7 @@ This module contains functions for detecting and rendering visual-only changes
 """
 from __future__ import with_statement
 
+from itertools import chain
 from genshi.core import QName, Attrs, START, END, TEXT
 
 from .config import INLINE_FORMATTING_TAGS, BLOCK_WRAPPER_TAGS
@@ -18,7 +19,21 @@ from .utils import (
 from .text_differ import mark_text
 
 
-def try_visual_wrapper_toggle_without_dup(differ, old_events, new_events):
+def compute_replace_features(old_events, new_events):
+    """
+    Precalcula los datos que comparten varios probes de
+    _handle_replace_special_cases (strip de espacios en los bordes y texto
+    colapsado), para no repetir las mismas pasadas O(n) en cada predicado.
+    """
+    return {
+        'old_edges': strip_edge_whitespace_events(old_events),
+        'new_edges': strip_edge_whitespace_events(new_events),
+        'old_text': extract_text_from_events(old_events),
+        'new_text': extract_text_from_events(new_events),
+    }
+
+
+def try_visual_wrapper_toggle_without_dup(differ, old_events, new_events, features=None):
     """
     If one side is plain text and the other wraps the *same* text in a single
     inline wrapper with visual attrs (style/class/id), render only one copy
@@ -28,8 +43,8 @@ def try_visual_wrapper_toggle_without_dup(differ, old_events, new_events):
     and avoids duplicating values inside <td>/<th>.
     """
 
-    def parse(events):
-        lws, core, tws = strip_edge_whitespace_events(events)
+    def parse(events, edges):
+        lws, core, tws = edges if edges is not None else strip_edge_whitespace_events(events)
         if len(core) == 1 and core[0][0] == TEXT:
             return ('plain', lws, core[0], tws, None, None)
         if len(core) >= 3 and core[0][0] == START and core[-1][0] == END:
@@ -41,8 +56,8 @@ def try_visual_wrapper_toggle_without_dup(differ, old_events, new_events):
                     return ('wrap', lws, inner, tws, (tag, attrs), lname)
         return None
 
-    o = parse(old_events)
-    n = parse(new_events)
+    o = parse(old_events, features['old_edges'] if features is not None else None)
+    n = parse(new_events, features['new_edges'] if features is not None else None)
     if not o or not n:
         return False
 
@@ -54,22 +69,20 @@ def try_visual_wrapper_toggle_without_dup(differ, old_events, new_events):
             return False
         if collapse_ws(o_text_ev[1]) != collapse_ws(extract_text_from_events(n_inner)):
             return False
-        for ev in n_lws:
-            differ.append(*ev)
         # Genshi Attrs is list-like, not dict-like
         attrs2 = Attrs(list(n_attrs))
         attrs2 = differ.inject_class(attrs2, 'tagdiff_replaced')
         attrs2 |= [(QName('data-old-tag'), 'none')]
-        if getattr(differ.config, 'add_diff_ids', False):
+        if differ._add_diff_ids:
             diff_id = differ._active_diff_id() or differ._new_diff_id()
-            attrs2 = differ._set_attr(attrs2, getattr(differ.config, 'diff_id_attr', 'data-diff-id'), diff_id)
+            attrs2 = differ._set_attr(attrs2, differ._diff_id_attr, diff_id)
         pos = (n_inner[0][2] if n_inner else (new_events[0][2] if new_events else old_events[0][2]))
-        differ.append(START, (n_tag, attrs2), pos)
-        for ev in n_inner:
-            differ.append(*ev)
-        differ.append(END, n_tag, pos)
-        for ev in n_tws:
-            differ.append(*ev)
+        # Emisión en bloque de todo el wrapper en un solo extend_raw.
+        differ.extend_raw(chain(n_lws,
+                                ((START, (n_tag, attrs2), pos),),
+                                n_inner,
+                                ((END, n_tag, pos),),
+                                n_tws))
         return True
 
     # Removal: styled wrapper -> plain
@@ -80,27 +93,25 @@ def try_visual_wrapper_toggle_without_dup(differ, old_events, new_events):
             return False
         if collapse_ws(extract_text_from_events(o_inner)) != collapse_ws(n_text_ev[1]):
             return False
-        for ev in n_lws:
-            differ.append(*ev)
         span_tag = QName('span')
         span_attrs = Attrs()
         span_attrs |= [(QName('data-old-tag'), o_lname)]
         span_attrs = differ.inject_refattr(span_attrs, o_attrs)
         span_attrs = differ.inject_class(span_attrs, 'tagdiff_replaced')
-        if getattr(differ.config, 'add_diff_ids', False):
+        if differ._add_diff_ids:
             diff_id = differ._active_diff_id() or differ._new_diff_id()
-            span_attrs = differ._set_attr(span_attrs, getattr(differ.config, 'diff_id_attr', 'data-diff-id'), diff_id)
-        differ.append(START, (span_tag, span_attrs), n_text_ev[2])
-        differ.append(*n_text_ev)
-        differ.append(END, span_tag, n_text_ev[2])
-        for ev in n_tws:
-            differ.append(*ev)
+            span_attrs = differ._set_attr(span_attrs, differ._diff_id_attr, diff_id)
+        differ.extend_raw(chain(n_lws,
+                                ((START, (span_tag, span_attrs), n_text_ev[2]),
+                                 n_text_ev,
+                                 (END, span_tag, n_text_ev[2])),
+                                n_tws))
         return True
 
     return False
 
 
-def can_unwrap_wrapper(differ, old_events, new_events):
+def can_unwrap_wrapper(differ, old_events, new_events, features=None):
     """
     Detect cases like:
       old: <strong>TEXT</strong>
@@ -123,8 +134,12 @@ def can_unwrap_wrapper(differ, old_events, new_events):
 
     old_tag, old_txt = unwrap(old_events)
     new_tag, new_txt = unwrap(new_events)
-    old_plain = extract_text_from_events(old_events)
-    new_plain = extract_text_from_events(new_events)
+    if features is not None:
+        old_plain = features['old_text']
+        new_plain = features['new_text']
+    else:
+        old_plain = extract_text_from_events(old_events)
+        new_plain = extract_text_from_events(new_events)
 
     # old wrapped -> new plain with same text
     if old_tag and (not new_tag) and old_txt and old_txt == collapse_ws(new_plain):
@@ -135,7 +150,7 @@ def can_unwrap_wrapper(differ, old_events, new_events):
     return False
 
 
-def can_visual_container_replace(differ, old_events, new_events):
+def can_visual_container_replace(differ, old_events, new_events, features=None):
     """
     Detect container/tag/attribute-only changes that should still produce a
     visible diff:
@@ -148,8 +163,12 @@ def can_visual_container_replace(differ, old_events, new_events):
     """
     if not old_events or not new_events:
         return False
-    _lws, old_events, _tws = strip_edge_whitespace_events(old_events)
-    _lws2, new_events, _tws2 = strip_edge_whitespace_events(new_events)
+    if features is not None:
+        _lws, old_events, _tws = features['old_edges']
+        _lws2, new_events, _tws2 = features['new_edges']
+    else:
+        _lws, old_events, _tws = strip_edge_whitespace_events(old_events)
+        _lws2, new_events, _tws2 = strip_edge_whitespace_events(new_events)
     if not old_events or not new_events:
         return False
     if old_events[0][0] != START or old_events[-1][0] != END:
@@ -166,8 +185,14 @@ def can_visual_container_replace(differ, old_events, new_events):
     if old_lname not in allowed and new_lname not in allowed:
         return False
 
-    old_txt = extract_text_from_events(old_events)
-    new_txt = extract_text_from_events(new_events)
+    # El texto colapsado no cambia al quitar los TEXT de borde, así que los
+    # valores precalculados sobre los eventos completos sirven igual.
+    if features is not None:
+        old_txt = features['old_text']
+        new_txt = features['new_text']
+    else:
+        old_txt = extract_text_from_events(old_events)
+        new_txt = extract_text_from_events(new_events)
     if not old_txt or not new_txt:
         return False
     if collapse_ws(old_txt) != collapse_ws(new_txt):
@@ -273,8 +298,7 @@ def render_visual_replace_inline(differ, old_events, new_events):
     lws_new, new_core, tws_new = strip_edge_whitespace_events(new_events)
 
     # Preserve leading/trailing whitespace events (mostly new-side to keep DOM stable)
-    for ev in lws_new:
-        differ.append(*ev)
+    differ.extend_raw(lws_new)
 
     old_events = old_core
     new_events = new_core
@@ -323,8 +347,7 @@ def render_visual_replace_inline(differ, old_events, new_events):
         else:
             wrap_inline_visual_replace(differ, 'ins', new_wrap, new_attrs, new_inner, pos)
 
-    for ev in tws_new:
-        differ.append(*ev)
+    differ.extend_raw(tws_new)
 
 
 def find_inline_wrapper_bounds(events):